@@ -35,22 +35,101 @@ import arguments
 import samples
 
 
+#arguments already built during the current explainAges run, keyed by
+#argumentKey; None when no run is going on (so nothing is memoized)
+_memo = None
+#the frozen initial environment of the current run
+_env = None
+#keys of the arguments being built right now, for catching rules that
+#(eventually) depend on their own conclusion
+_building = set()
+#how the memo did during the last explainAges run; callers that care can
+#read it after the run
+memoStats = {'hits':0, 'misses':0, 'cycles':0}
+
 def explainAges():
     """
     Attempts to explain ages and stuff.
     """
+    global _memo, _env
     
-    result = [(buildArgument(conclusion)).toEvidence() 
-               for conclusion in conclusions.getConclusions()]
+    _memo = {}
+    _env = _freeze(samples.initEnv)
+    _building.clear()
+    memoStats.update(hits=0, misses=0, cycles=0)
+    try:
+        result = [(buildArgument(conclusion)).toEvidence() 
+                   for conclusion in conclusions.getConclusions()]
+    finally:
+        _memo = _env = None
+        _building.clear()
         
     return result
+
+def _freeze(value):
+    """
+    Returns a hashable version of value (dictionaries, lists and sets are 
+    turned into tuples/frozensets of their frozen contents)
+    """
+    if isinstance(value, dict):
+        return tuple(sorted([(key, _freeze(item)) for key, item in value.iteritems()]))
+    elif isinstance(value, (list, tuple)):
+        return tuple([_freeze(item) for item in value])
+    elif isinstance(value, (set, frozenset)):
+        return frozenset([_freeze(item) for item in value])
+    return value
+
+def argumentKey(conclusion, env):
+    """
+    Returns the memo key for a filled conclusion built in the (frozen) initial
+    environment env, or None if the conclusion's parameters can't be hashed.
+    Rules only see their conclusion's parameters and the initial environment
+    (see Conclusion.buildEnv), so those decide what argument gets built.
+    """
+    key = (conclusion.name, _freeze(conclusion.paramList or ()), env)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
     
 def buildArgument(conclusion):
     """
     builds an argument for the conclusion given. The conclusion should contain "filled" parameters,
     if it has any parameters.
+    
+    During an explainAges run, arguments are built once for each conclusion 
+    and reused after that. An argument for a conclusion that is already being
+    built further up (through mutually recursive rules) is empty.
     """
+    if _memo is None:
+        return _buildArgument(conclusion)
+    
+    key = argumentKey(conclusion, _env)
+    if key is None:
+        memoStats['misses'] += 1
+        return _buildArgument(conclusion)
+    try:
+        argument = _memo[key]
+    except KeyError:
+        pass
+    else:
+        memoStats['hits'] += 1
+        return argument
+    if key in _building:
+        memoStats['cycles'] += 1
+        return arguments.Argument(conclusion, [])
+    
+    memoStats['misses'] += 1
+    _building.add(key)
+    try:
+        argument = _buildArgument(conclusion)
+    finally:
+        _building.discard(key)
+    _memo[key] = argument
+    return argument
     
+def _buildArgument(conclusion):
     ruleList = rules.getRules(conclusion)
     runRules = []
     
@@ -38,18 +38,39 @@ import confidence
 import evidence
 
 ruleList = []
+#(conclusion name, number of parameters) -> rules for that conclusion, in the
+#order they were made
+ruleIndex = {}
+
+def ruleKey(conclusion):
+    """
+    Returns the index key for a conclusion; conclusions with the same key are
+    equal as far as rule matching is concerned (see Conclusion.__eq__)
+    """
+    return (conclusion.name, len(conclusion.paramList or ()))
 
 def makeRule(conclusion, rhsList, quality, guard=None, template=confidence.Template()):
     """
     Adds a new rule to the list of rules the system knows about.
     """
-    ruleList.append(Rule(conclusion, guard, rhsList, quality, template))
+    rule = Rule(conclusion, guard, rhsList, quality, template)
+    ruleList.append(rule)
+    ruleIndex.setdefault(ruleKey(rule.conclusion), []).append(rule)
+    
+def rebuildIndex():
+    """
+    Re-creates the rule index from ruleList; call this after changing ruleList
+    other than through makeRule (for example, when reloading the rule base)
+    """
+    ruleIndex.clear()
+    for rule in ruleList:
+        ruleIndex.setdefault(ruleKey(rule.conclusion), []).append(rule)
     
 def getRules(conclusion):
     """
     Returns the list of all rules with the appropriate conclusion name and number of arguments
     """
-    return [rule for rule in ruleList if rule.conclusion == conclusion]
+    return list(ruleIndex.get(ruleKey(conclusion), ()))
 
 
 
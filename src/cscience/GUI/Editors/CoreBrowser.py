@@ -34,13 +34,16 @@ import wx.lib.delayedresult
 
 import os
 import csv
+import gzip
+import contextlib
 
 from cscience import datastore
-from cscience.GUI import events
+from cscience.GUI import dialogs, events
 from cscience.GUI.Editors import AttEditor, MilieuBrowser, ComputationPlanBrowser, \
             FilterEditor, TemplateEditor, ViewEditor, MemoryFrame
 from cscience.GUI.Util import SampleBrowserView, PlotOptions, PlotWindow, grid
-from cscience.framework import Core, Sample
+from cscience.framework import Core, Sample, ExecutionProfile, Checkpoint, \
+    Ensemble
 
 import calvin.argue
         
@@ -48,9 +51,9 @@ import calvin.argue
 class SampleGridTable(grid.UpdatingTable):
     def __init__(self, *args, **kwargs):
         self._samples = []
-        #The samples shown get updated when the view is updated (since text
-        #search is redone), so this doesn't need to be a property to re-draw.
-        self.view = []
+        self._view = []
+        #row -> {column -> formatted text}, filled in as cells are painted
+        self._cells = {}
         super(SampleGridTable, self).__init__(*args, **kwargs)
 
     @property
@@ -59,8 +62,19 @@ class SampleGridTable(grid.UpdatingTable):
     @samples.setter
     def samples(self, value):
         self._samples = value
+        self._cells = {}
         self.reset_view()
         
+    #The samples shown get updated when the view is updated (since text
+    #search is redone), so setting the view doesn't need to re-draw.
+    @property
+    def view(self):
+        return self._view
+    @view.setter
+    def view(self, value):
+        self._view = value
+        self._cells = {}
+        
     def GetNumberRows(self):
         return len(self.samples) or 1
     def GetNumberCols(self):
@@ -70,7 +84,19 @@ class SampleGridTable(grid.UpdatingTable):
             return "The current view has no attributes defined for it."
         elif not self.samples:
             return ''
-        return str(self.samples[row][self.view[col+1]])
+        cells = self._cells.setdefault(row, {})
+        try:
+            return cells[col]
+        except KeyError:
+            att = self.view[col+1]
+            value = self.samples[row][att]
+            try:
+                text = datastore.sample_attributes.format_value(att, value)
+            except (KeyError, TypeError, ValueError):
+                #unknown attribute, or a value not of the attribute's type
+                text = unicode(value)
+            cells[col] = text
+            return text
     def GetRowLabelValue(self, row):
         if not self.samples:
             return ''
@@ -86,6 +112,9 @@ class SampleGridTable(grid.UpdatingTable):
 class CoreBrowser(MemoryFrame):
     
     framename = 'samplebrowser'
+    #ms to wait after the search text changes before searching
+    search_delay = 250
+    no_sort = '<None>'
     
     def __init__(self):
         super(CoreBrowser, self).__init__(parent=None, id=wx.ID_ANY, 
@@ -94,6 +123,19 @@ class CoreBrowser(MemoryFrame):
         self.Show(False)
         self.browser_view = SampleBrowserView()        
         self.core = None
+        self.samples = []
+        self.displayed_samples = []
+        #the settings the currently displayed samples were found with
+        self.displayed_query = None
+        #((samples, sort keys, direction), all those samples in that order)
+        self.sort_cache = None
+        #displayed samples are worked out in the background; each update asked
+        #for gets a new generation, and only the latest is shown
+        self.generation = 0
+        self.aborting = None
+        self.pending_update = None
+        #the plot window, which follows the displayed samples once open
+        self.plot_window = None
         
         self.CreateStatusBar()
         self.create_menus()
@@ -233,6 +275,8 @@ class CoreBrowser(MemoryFrame):
                                 style=wx.CB_DROPDOWN | wx.CB_READONLY | wx.CB_SORT)
         self.sselect_sec = wx.ComboBox(self, wx.ID_ANY, choices=["Not Sorted"], 
                                 style=wx.CB_DROPDOWN | wx.CB_READONLY | wx.CB_SORT)
+        self.sselect_ter = wx.ComboBox(self, wx.ID_ANY, choices=[self.no_sort], 
+                                style=wx.CB_DROPDOWN | wx.CB_READONLY | wx.CB_SORT)
         self.sdir_select = wx.ComboBox(self, wx.ID_ANY, 
                     value=self.browser_view.get_direction(), 
                     choices=["Ascending", "Descending"], 
@@ -240,6 +284,7 @@ class CoreBrowser(MemoryFrame):
         self.plotbutton = wx.Button(self, wx.ID_ANY, "Plot Attributes...")
         self.Bind(wx.EVT_COMBOBOX, self.OnChangeSort, self.sselect_prim)
         self.Bind(wx.EVT_COMBOBOX, self.OnChangeSort, self.sselect_sec)
+        self.Bind(wx.EVT_COMBOBOX, self.OnChangeSort, self.sselect_ter)
         self.Bind(wx.EVT_COMBOBOX, self.OnSortDirection, self.sdir_select)
         self.Bind(wx.EVT_BUTTON, self.do_plot, self.plotbutton)
         
@@ -273,6 +318,8 @@ class CoreBrowser(MemoryFrame):
         row_sizer.Add(self.sselect_prim, border=5, flag=wx.ALL)
         row_sizer.Add(wx.StaticText(self, wx.ID_ANY, "and then by"), border=5, flag=wx.ALL)
         row_sizer.Add(self.sselect_sec, border=5, flag=wx.ALL)
+        row_sizer.Add(wx.StaticText(self, wx.ID_ANY, "and then by"), border=5, flag=wx.ALL)
+        row_sizer.Add(self.sselect_ter, border=5, flag=wx.ALL)
         row_sizer.Add(self.sdir_select, border=5, flag=wx.ALL)
         row_sizer.Add(self.plotbutton, border=5, flag=wx.ALL)
         sizer.Add(row_sizer, flag=wx.EXPAND)
@@ -419,7 +466,6 @@ class CoreBrowser(MemoryFrame):
         self.filter_samples()
         
     def filter_samples(self):
-        self.displayed_samples = None
         filter_name = self.browser_view.get_filter()
         try:
             filt = datastore.filters[filter_name]
@@ -427,55 +473,146 @@ class CoreBrowser(MemoryFrame):
             self.browser_view.set_filter('<No Filter>')
             self.selected_filter.SetStringSelection('<No Filter>')
             self.filter_desc.SetLabel('No Filter Selected')
-            filtered_samples = self.samples[:]
         else:
             self.filter_desc.SetLabel(filt.description)
-            filtered_samples = filter(filt.apply, self.samples)
-        self.search_samples(filtered_samples)
+        self.update_samples()
 
-    def search_samples(self, filtered_samples=[]):
-        value = self.search_box.GetValue()
-        
-        if value:
-            if not self.exact_box.IsChecked() and self.displayed_samples and \
-               self.previous_query in value:
-                samples_to_search = self.displayed_samples
-            else:
-                samples_to_search = filtered_samples
-            
-            self.previous_query = value
-            view = datastore.views[self.browser_view.get_view()]
-            self.displayed_samples = [s for s in samples_to_search if 
-                                s.search(value, view, self.exact_box.IsChecked())]
-        else:
-            self.displayed_samples = filtered_samples
-            self.previous_query = ''
-        self.display_samples()
-        
-    def display_samples(self):        
-        def sort_none_last(x, y):
-            def cp_none(x, y):
-                if x is None and y is None:
-                    return 0
-                elif x is None:
-                    return 1
-                elif y is None:
-                    return -1
-                else:
-                    return cmp(x, y)
-            for a, b in zip(x, y):
-                val = cp_none(a, b)
-                if val:
-                    return val
-            return 0
+    def search_samples(self):
+        #wait for typing to pause before searching
+        self.update_samples(self.search_delay)
         
-        self.displayed_samples.sort(cmp=sort_none_last, 
-                            key=lambda s: (s[self.browser_view.get_primary()], 
-                                           s[self.browser_view.get_secondary()]), 
-                            reverse=self.GetSortDirection())
+    def display_samples(self):
+        self.update_samples()
         
-        self.table.view = datastore.views[self.browser_view.get_view()]
-        self.table.samples = self.displayed_samples
+    def update_samples(self, delay=0):
+        """
+        Re-runs filter -> search -> sort for the current core and settings on
+        a worker thread, after delay ms if given. Any earlier update still 
+        waiting or running is cancelled; only the latest one's results are 
+        ever shown.
+        """
+        self.generation += 1
+        if self.aborting is not None:
+            self.aborting.set()
+            self.aborting = None
+        if self.pending_update is not None:
+            self.pending_update.Stop()
+            self.pending_update = None
+        if delay:
+            self.pending_update = wx.CallLater(delay, self.start_update, 
+                                               self.generation)
+        else:
+            self.start_update(self.generation)
+            
+    def start_update(self, generation):
+        if generation != self.generation:
+            return
+        self.pending_update = None
+        query = {'samples':self.samples,
+                 'filter':datastore.filters.get(self.browser_view.get_filter()),
+                 'value':self.search_box.GetValue(),
+                 'exact':self.exact_box.IsChecked(),
+                 'view':datastore.views[self.browser_view.get_view()],
+                 'keys':tuple(self.browser_view.get_sort_keys()),
+                 'descending':self.GetSortDirection(),
+                 #workers only ever see a snapshot of the cache; it's updated
+                 #back on this thread, in show_samples
+                 'sort cache':self.sort_cache}
+        #a longer (inexact) search on the same samples only needs to look
+        #through what the last search found
+        previous = self.displayed_query
+        if previous and not query['exact'] and previous['value'] and \
+                previous['value'] != query['value'] and \
+                previous['value'] in query['value'] and \
+                all([previous[key] is query[key] for key in 
+                     ('samples', 'filter', 'view')]):
+            query['searched'] = self.displayed_samples
+        self.aborting = wx.lib.delayedresult.AbortEvent()
+        wx.lib.delayedresult.startWorker(self.show_samples, self.find_samples,
+                                         wargs=(query, self.aborting),
+                                         cargs=(generation, query))
+    
+    def find_samples(self, query, aborting):
+        """
+        Works out which samples to display, and in what order, for query.
+        Runs on a worker thread, so this must not touch any controls (or any
+        other state of the browser); returns the samples and the sort used 
+        (see sorted_samples), or None if aborted partway.
+        """
+        def select(samples, test):
+            selected = []
+            for index, sample in enumerate(samples):
+                if index % 500 == 0 and aborting():
+                    return None
+                if test(sample):
+                    selected.append(sample)
+            return selected
+        
+        samples = query.get('searched')
+        if samples is None:
+            samples = query['samples']
+            if query['filter'] is not None:
+                samples = select(samples, query['filter'].apply)
+            if samples is not None and query['value']:
+                samples = select(samples, lambda s: s.search(query['value'],
+                                                  query['view'], query['exact']))
+        elif query['value']:
+            samples = select(samples, lambda s: s.search(query['value'], 
+                                              query['view'], query['exact']))
+        if samples is None or aborting():
+            return None
+        #sorting all the samples once and picking out the ones wanted is 
+        #cheaper than sorting each new subset
+        sort = self.sorted_samples(query)
+        chosen = set([id(sample) for sample in samples])
+        return [sample for sample in sort[1] if id(sample) in chosen], sort
+    
+    def sorted_samples(self, query):
+        """
+        Returns (token, all of query's samples in the order given by its 
+        sort keys), reusing the query's cached sort if it was of the same 
+        samples by the same keys. Samples without a value for a key sort after
+        those with one, in either direction.
+        """
+        token = (query['samples'], query['keys'], query['descending'])
+        cached = query['sort cache']
+        if cached and cached[0][0] is token[0] and cached[0][1:] == token[1:]:
+            return cached
+        
+        keys = query['keys']
+        #sorting on (has no value, value) puts Nones last; reversing the 
+        #sort would put them first, so flip the flag for descending sorts.
+        missing_last = not query['descending']
+        def sort_key(sample):
+            values = [sample[key] for key in keys]
+            return tuple([((value is None) == missing_last, value) 
+                          for value in values])
+        order = sorted(query['samples'], key=sort_key, 
+                       reverse=query['descending'])
+        return (token, order)
+    
+    def show_samples(self, dresult, generation, query):
+        if not self:
+            #the browser was closed while the samples were being found
+            return
+        try:
+            result = dresult.get()
+        except Exception as exc:
+            if generation == self.generation:
+                wx.MessageBox("There was a problem updating the displayed "
+                              "samples: %s" % exc, "Display Failed",
+                              wx.OK | wx.ICON_ERROR)
+            return
+        if result is None or generation != self.generation:
+            #a newer update has been asked for since this one started
+            return
+        samples, self.sort_cache = result
+        self.aborting = None
+        self.displayed_samples = samples
+        self.displayed_query = query
+        self.table.view = query['view']
+        self.table.samples = samples
+        events.notify('displayed samples', samples)
         
     def OnTextSearchUpdate(self, event):
         self.search_samples()
@@ -484,36 +621,103 @@ class CoreBrowser(MemoryFrame):
         
         view_name = self.browser_view.get_view()
         view = datastore.views[view_name]
-        # add header labels -- need to use iterator to get computation_plan/id correct
-        rows = [att for att in view]
-        rows.extend([[sample[att] for att in view] for sample in self.displayed_samples])
+        # header labels -- need to use iterator to get computation_plan/id correct
+        atts = [att for att in view]
+        samples = self.displayed_samples
         
         wildcard = "CSV Files (*.csv)|*.csv|"     \
+                   "Compressed CSV Files (*.csv.gz)|*.csv.gz|" \
                    "All files (*.*)|*.*"
 
         dlg = wx.FileDialog(self, message="Save view in ...", defaultDir=os.getcwd(), defaultFile="view.csv", wildcard=wildcard, style=wx.SAVE | wx.CHANGE_DIR | wx.OVERWRITE_PROMPT)
         dlg.SetFilterIndex(0)
         
         if dlg.ShowModal() == wx.ID_OK:
-            path = dlg.GetPath()        
-            tmp = open(path, "wb")
-            writer = csv.writer(tmp)
-            writer.writerows(rows)
-        
-            tmp.flush()
-            tmp.close()
+            path = dlg.GetPath()
+            if dlg.GetFilterIndex() == 1 and not path.endswith('.gz'):
+                path += '.gz'
             
             the_dir = os.path.dirname(path)
             os.chdir(the_dir)
             
+            progress = wx.ProgressDialog("Exporting Samples", 
+                        "Writing %d samples to %s" % (len(samples), path),
+                        maximum=max(len(samples), 1), parent=self,
+                        style=wx.PD_CAN_ABORT | wx.PD_APP_MODAL | 
+                              wx.PD_ELAPSED_TIME | wx.PD_REMAINING_TIME)
+            aborting = wx.lib.delayedresult.AbortEvent()
+            def report(count):
+                wx.CallAfter(self.update_progress, progress, aborting, count)
+            wx.lib.delayedresult.startWorker(self.OnExportDone, self.export_samples,
+                                wargs=(path, atts, samples, aborting, report),
+                                cargs=(path, progress))
         dlg.Destroy()
+        
+    def export_samples(self, path, atts, samples, aborting, report):
+        """
+        Writes atts of samples to path as CSV (gzipped if path ends in .gz), 
+        one row at a time; runs on a worker thread. Returns False if aborted.
+        
+        The rows go to a separate file that only replaces path once they're 
+        all written, so an aborted or failed export leaves nothing (and any
+        existing file at path untouched) behind.
+        """
+        partial = path + '.part'
+        try:
+            with open(partial, 'wb') as raw:
+                if path.endswith('.gz'):
+                    #named for path, not the partial file, in the gzip header
+                    output = gzip.GzipFile(path, 'wb', fileobj=raw)
+                else:
+                    output = raw
+                with contextlib.closing(output):
+                    writer = csv.writer(output)
+                    writer.writerow([att.encode('utf-8') for att in atts])
+                    for index, sample in enumerate(samples):
+                        if index % 500 == 0:
+                            if aborting():
+                                return False
+                            report(index)
+                        writer.writerow([datastore.sample_attributes.format_value(
+                                                att, sample[att]).encode('utf-8') 
+                                         for att in atts])
+            if aborting():
+                return False
+            if os.name == 'nt' and os.path.exists(path):
+                #rename won't replace an existing file on Windows
+                os.remove(path)
+            os.rename(partial, path)
+            return True
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+    
+    def update_progress(self, progress, aborting, count):
+        if not progress or aborting():
+            return
+        if not progress.Update(count)[0]:
+            aborting.set()
+            
+    def OnExportDone(self, dresult, path, progress):
+        progress.Destroy()
+        try:
+            finished = dresult.get()
+        except Exception as exc:
+            wx.MessageBox('Could not export samples to %s: %s' % (path, exc),
+                          "Export Failed", wx.OK | wx.ICON_ERROR)
+        else:
+            if finished:
+                self.SetStatusText('Samples exported to %s' % path)
+            else:
+                self.SetStatusText('Export cancelled')
 
     def do_plot(self, event):
         #TODO: let user select all those pretty plotting options!
-        options = PlotOptions('depth')
-        pw = PlotWindow(self, self.displayed_samples, options)
-        pw.Show()
-        pw.Raise()
+        if not self.plot_window:
+            options = PlotOptions('depth')
+            self.plot_window = PlotWindow(self, self.displayed_samples, options)
+            self.plot_window.Show()
+        self.plot_window.Raise()
 
     def import_samples(self, event):
         dialog = wx.FileDialog(None,
@@ -526,62 +730,129 @@ class CoreBrowser(MemoryFrame):
         dialog.Destroy()
         
         if result == wx.ID_OK:
-            with open(path, 'rU') as input_file:
-                #allow whatever sane csv formats we can manage, here
-                sniffer = csv.Sniffer()
-                dialect = sniffer.sniff(input_file.read(1024))
-                dialect.skipinitialspace = True
-                input_file.seek(0)
-                
-                reader = csv.DictReader(input_file, dialect=dialect)
-                if not reader.fieldnames:
-                    wx.MessageBox("Selected file is empty.", "Operation Cancelled", 
-                                  wx.OK | wx.ICON_INFORMATION)
-                    return
+            progress = wx.ProgressDialog("Importing Samples", 
+                        "Reading samples from %s" % path,
+                        maximum=max(os.path.getsize(path), 1), parent=self,
+                        style=wx.PD_CAN_ABORT | wx.PD_APP_MODAL | 
+                              wx.PD_ELAPSED_TIME)
+            aborting = wx.lib.delayedresult.AbortEvent()
+            def report(position):
+                wx.CallAfter(self.update_progress, progress, aborting, position)
+            wx.lib.delayedresult.startWorker(self.OnSamplesRead, self.read_samples,
+                                wargs=(path, aborting, report),
+                                cargs=(path, progress))
+            
+    def read_samples(self, path, aborting, report, sample_size=65536):
+        """
+        Reads and converts all the samples in the CSV file at path; runs on a
+        worker thread. Returns None if aborted, otherwise the file's field
+        names, the converted samples, and any problems found (see 
+        Attributes.load_samples).
+        """
+        with open(path, 'rU') as input_file:
+            #allow whatever sane csv formats we can manage, here
+            try:
+                dialect = csv.Sniffer().sniff(input_file.read(sample_size))
+            except csv.Error:
+                dialect = csv.excel
+            input_file.seek(0)
+            
+            reader = csv.reader(input_file, dialect=dialect, 
+                                skipinitialspace=True)
+            try:
                 #strip extra spaces, since that was apparently a problem before?
-                reader.fieldnames = [name.strip() for name in reader.fieldnames]
-                   
-                if 'depth' not in reader.fieldnames:
-                    wx.MessageBox("Selected file is missing the required attribute 'depth'.", 
-                                  "Operation Cancelled", wx.OK | wx.ICON_INFORMATION)
-                    return
-                
-                rows = []
-                for index, line in enumerate(reader, 1):
-                    #do appropriate type conversions...
-                    for key, value in line.iteritems():
-                        try:
-                            line[key] = datastore.sample_attributes.convert_value(key, value)
-                        except ValueError:
-                            wx.MessageBox("%s on row %i has an incorrect type."
-                                "Please update the csv file and try again." % (key, index),
-                                "Operation Cancelled", wx.OK | wx.ICON_INFORMATION)
+                fieldnames = [name.strip() for name in reader.next()]
+            except StopIteration:
+                return [], [], []
+            if 'depth' not in fieldnames:
+                return fieldnames, [], []
+            
+            def rows():
+                for number, row in enumerate(reader):
+                    if number % 1000 == 0:
+                        if aborting():
                             return
-                    rows.append(line)
-                if not rows:
-                    wx.MessageBox("Selected file appears to contain no data.", 
-                                  "Operation Cancelled", wx.OK | wx.ICON_INFORMATION)
-                    return
-                
-                dialog = DisplayImportedSamples(self, os.path.basename(path), 
-                                                reader.fieldnames, rows)
-                if dialog.ShowModal() == wx.ID_OK:
-                    if dialog.source_name:
-                        for item in rows:
-                            item['source'] = dialog.source_name
-                    cname = dialog.core_name
-                    core = datastore.cores.get(cname, None)
-                    if core is None:
-                        core = Core(cname)               
-                        datastore.cores[cname] = core            
-                    for item in rows:
-                        s = Sample('input', item)
-                        core.add(s)
-        
-                    wx.MessageBox('Core %s imported/updated' % cname, "Import Results",
-                                  wx.OK | wx.CENTRE)
-                    events.post_change(self, 'samples')
-                dialog.Destroy()
+                        report(input_file.tell())
+                    yield row
+            samples, errors = datastore.sample_attributes.load_samples(rows(), 
+                                                                  fieldnames)
+        if aborting():
+            return None
+        return fieldnames, samples, errors
+        
+    def OnSamplesRead(self, dresult, path, progress):
+        progress.Destroy()
+        try:
+            result = dresult.get()
+        except Exception as exc:
+            wx.MessageBox("Could not read %s: %s" % (path, exc), 
+                          "Operation Cancelled", wx.OK | wx.ICON_INFORMATION)
+            return
+        if result is None:
+            return
+        
+        fieldnames, rows, errors = result
+        if not fieldnames:
+            wx.MessageBox("Selected file is empty.", "Operation Cancelled", 
+                          wx.OK | wx.ICON_INFORMATION)
+            return
+        if 'depth' not in fieldnames:
+            wx.MessageBox("Selected file is missing the required attribute 'depth'.", 
+                          "Operation Cancelled", wx.OK | wx.ICON_INFORMATION)
+            return
+        if errors and not dialogs.confirm_bad_rows(errors, 
+                        "Problems Reading Samples",
+                        'Import the samples without them?'):
+            return
+        if not rows:
+            wx.MessageBox("Selected file appears to contain no data.", 
+                          "Operation Cancelled", wx.OK | wx.ICON_INFORMATION)
+            return
+        
+        dialog = DisplayImportedSamples(self, os.path.basename(path), 
+                                        [name for name in fieldnames if name], 
+                                        rows)
+        if dialog.ShowModal() == wx.ID_OK:
+            source = dialog.source_name
+            cname = dialog.core_name
+            core = datastore.cores.get(cname, None)
+            if core is None:
+                core = Core(cname)
+            
+            progress = wx.ProgressDialog("Importing Samples", 
+                        "Adding %d samples to core %s" % (len(rows), cname),
+                        parent=self, style=wx.PD_APP_MODAL | wx.PD_ELAPSED_TIME)
+            progress.Pulse()
+            wx.lib.delayedresult.startWorker(self.OnSamplesImported, 
+                                self.insert_samples, wargs=(core, rows, source),
+                                cargs=(core, progress))
+        dialog.Destroy()
+        
+    def insert_samples(self, core, rows, source=None):
+        """
+        Adds rows to core as new input samples, all in one go; runs on a 
+        worker thread.
+        """
+        samples = []
+        for item in rows:
+            if source:
+                item['source'] = source
+            samples.append(Sample('input', item))
+        core.add_all(samples)
+        
+    def OnSamplesImported(self, dresult, core, progress):
+        progress.Destroy()
+        try:
+            dresult.get()
+        except Exception as exc:
+            wx.MessageBox("There was an error importing the samples into core "
+                          "%s: %s" % (core.name, exc), "Import Failed",
+                          wx.OK | wx.ICON_ERROR)
+            return
+        datastore.cores[core.name] = core
+        wx.MessageBox('Core %s imported/updated' % core.name, "Import Results",
+                      wx.OK | wx.CENTRE)
+        events.post_change(self, 'samples')
 
     def OnRunCalvin(self, event):
         """
@@ -620,6 +891,7 @@ class CoreBrowser(MemoryFrame):
         
         self.sselect_prim.SetItems(view)
         self.sselect_sec.SetItems(view)
+        self.sselect_ter.SetItems([self.no_sort] + list(view))
 
         previous_primary = self.browser_view.get_primary()
         previous_secondary = self.browser_view.get_secondary()
@@ -635,6 +907,12 @@ class CoreBrowser(MemoryFrame):
         else:
             self.sselect_sec.SetStringSelection("computation plan")
             self.browser_view.set_secondary("computation plan")
+            
+        if self.browser_view.get_tertiary() in view:
+            self.sselect_ter.SetStringSelection(self.browser_view.get_tertiary())
+        else:
+            self.sselect_ter.SetStringSelection(self.no_sort)
+            self.browser_view.set_tertiary("")
         
         self.filter_samples()
 
@@ -652,6 +930,8 @@ class CoreBrowser(MemoryFrame):
     def OnChangeSort(self, event):
         self.browser_view.set_primary(self.sselect_prim.GetStringSelection())
         self.browser_view.set_secondary(self.sselect_sec.GetStringSelection())
+        tertiary = self.sselect_ter.GetStringSelection()
+        self.browser_view.set_tertiary('' if tertiary == self.no_sort else tertiary)
         self.display_samples()
         
 
@@ -661,40 +941,107 @@ class CoreBrowser(MemoryFrame):
         ret = dlg.ShowModal()
         plan = dlg.plan
         # depths = dlg.depths
+        use_cprofile = dlg.use_cprofile
+        draws = dlg.draws
         dlg.Destroy()
         if ret != wx.ID_OK:
             return
         computation_plan = datastore.computation_plans[plan]
         workflow = datastore.workflows[computation_plan['workflow']]
-        vcore = self.core.new_computation(plan)
+        if workflow.register_outputs(computation_plan):
+            events.post_change(self, 'attributes')
+        if draws:
+            ensemble = Ensemble(draws)
+            try:
+                workflow.ensemble_chain(workflow.instantiate(computation_plan))
+            except ValueError as exc:
+                wx.MessageBox(str(exc), "Cannot Run Ensemble", 
+                              wx.OK | wx.ICON_ERROR)
+                return
+            if ensemble.register_outputs(workflow.find_outputs(computation_plan)):
+                events.post_change(self, 'attributes')
+            execute = lambda cplan, vcore, aborting, **kwargs: \
+                workflow.execute_ensemble(cplan, vcore, aborting, ensemble, **kwargs)
+            mode = ensemble.mode
+        else:
+            execute = workflow.execute
+            mode = None
+        if plan in self.core.cplans:
+            #only redo the samples whose inputs changed since the last run
+            #(or all of them, if the plan was last run differently); their
+            #old results are cleared first, so a plain run after an ensemble
+            #doesn't leave the ensemble's medians and percentiles behind
+            depths = workflow.changed_depths(computation_plan, self.core, mode)
+            if not depths:
+                wx.MessageBox("Computation '%s' is already up to date for "
+                              "this core." % plan, "Nothing to Compute",
+                              wx.OK | wx.ICON_INFORMATION)
+                return
+            vcore = self.core.recompute(plan, depths)
+        else:
+            vcore = self.core.new_computation(plan)
         aborting = wx.lib.delayedresult.AbortEvent()
         
         self.button_panel.Disable()
         self.plotbutton.Disable()
         
         dialog = WorkflowProgress(self, "Applying Computation '%s'" % plan)
-        wx.lib.delayedresult.startWorker(self.OnDatingDone, workflow.execute, 
+        profile = ExecutionProfile(plan, self.core.name, use_cprofile,
+                        lambda record: wx.CallAfter(dialog.add_record, record))
+        #progress is kept on disk, so an aborted or failed run can be resumed
+        checkpoint = Checkpoint(os.path.join(datastore.data_source, 'checkpoints'),
+                                plan, self.core.name)
+        wx.lib.delayedresult.startWorker(self.OnDatingDone, execute, 
                                   wargs=(computation_plan, vcore, aborting),
-                                  cargs=(plan, self.core, dialog))
+                                  wkwargs={'profile':profile, 
+                                           'checkpoint':checkpoint},
+                                  cargs=(vcore, dialog, profile, checkpoint))
         if dialog.ShowModal() != wx.ID_OK:
+            #the worker stops at its next check; the partial results are 
+            #thrown away once it has (see OnDatingDone), so only one thread
+            #ever touches the core
             aborting.set()
-            self.core.strip_experiment(plan)
         dialog.Destroy()
 
-    def OnDatingDone(self, dresult, planname, core, dialog):
+    def OnDatingDone(self, dresult, vcore, dialog, profile, checkpoint):
         try:
             result = dresult.get()
         except Exception as exc:
-            core.strip_experiment(planname)
+            self.save_profile(profile)
+            vcore.discard()
             print exc
+            if dialog:
+                dialog.EndModal(wx.ID_CANCEL)
             wx.MessageBox("There was an error running the requested computation."
                           " Please contact support.")
         else:
-            dialog.EndModal(wx.ID_OK)
+            if result:
+                self.save_profile(profile)
+                if checkpoint.resumed:
+                    self.SetStatusText('Computation resumed from a previous, '
+                                       'interrupted run')
+                if dialog:
+                    dialog.EndModal(wx.ID_OK)
+            else:
+                #aborted; the dialog is already gone
+                vcore.discard()
             events.post_change(self, 'samples')
         finally:
             self.button_panel.Enable()
             self.plotbutton.Enable()
+            
+    def save_profile(self, profile):
+        """
+        Saves the timing report for a computation run in the 'profiles' 
+        directory of the current repository.
+        """
+        try:
+            written = profile.write_report(os.path.join(datastore.data_source,
+                                                        'profiles'))
+        except (IOError, OSError) as exc:
+            print "could not save computation profile:", exc
+        else:
+            self.SetStatusText('Computation profile saved to %s' % written[0])
         
     def OnStripExperiment(self, event):
         
@@ -786,12 +1133,15 @@ class DisplayImportedSamples(wx.Dialog):
             else:
                 return self.core_name.GetValue()
     
+    #only this many samples are put in the preview grid
+    preview_rows = 200
+    
     def __init__(self, parent, csv_file, fields, rows):
         super(DisplayImportedSamples, self).__init__(parent, wx.ID_ANY, 'Import Samples')
         
         #remove file extension
         name = csv_file.rsplit('.', 1)[0]
-        grid = self.create_grid(fields, rows)
+        grid = self.create_grid(fields, rows[:self.preview_rows])
         
         self.core_panel = DisplayImportedSamples.CorePanel(self, name)
         #panel for adding a source, if one doesn't already exist
@@ -808,8 +1158,12 @@ class DisplayImportedSamples(wx.Dialog):
 
         btnsizer = self.CreateButtonSizer(wx.OK | wx.CANCEL)
         sizer = wx.BoxSizer(wx.VERTICAL)
-        sizer.Add(wx.StaticText(self, wx.ID_ANY, 
-                    "The following samples are contained in %s:" % csv_file),
+        if len(rows) > self.preview_rows:
+            description = "The first %d of the %d samples contained in %s:" % \
+                          (self.preview_rows, len(rows), csv_file)
+        else:
+            description = "The following samples are contained in %s:" % csv_file
+        sizer.Add(wx.StaticText(self, wx.ID_ANY, description),
                   border=5, flag=wx.ALL)
         sizer.Add(grid, border=5, proportion=1, flag=wx.ALL | wx.EXPAND)
         sizer.Add(self.core_panel, border=5, flag=wx.ALL)
@@ -834,10 +1188,12 @@ class DisplayImportedSamples(wx.Dialog):
             g.SetColLabelValue(index, att.replace(' ', '\n'))            
         
         # fill out grid with values
+        g.BeginBatch()
         for row_index, sample in enumerate(rows):
             g.SetRowLabelValue(row_index, str(sample['depth']))
             for col_index, att in enumerate(fields):
-                g.SetCellValue(row_index, col_index, str(sample[att]))                
+                g.SetCellValue(row_index, col_index, unicode(sample[att]))                
+        g.EndBatch()
                
         g.AutoSize()
         return g
@@ -858,10 +1214,15 @@ class ComputationDialog(wx.Dialog):
                                     title="Run Computations")
 
         self.core = core
-        #TODO: exclude plans already run on this core...
+        #plans already run on this core are re-run only where inputs changed
         self.planchoice = wx.Choice(self, wx.ID_ANY, 
                 choices=["<SELECT PLAN>"] + 
                          sorted(datastore.computation_plans.keys()))
+        self.profilecheck = wx.CheckBox(self, wx.ID_ANY, 
+                                        "Capture detailed profile (cProfile)")
+        #0 draws is a plain run; anything more runs the plan as an ensemble
+        self.drawspin = wx.SpinCtrl(self, wx.ID_ANY, min=0, max=100000, 
+                                    initial=0)
         #TODO: sorting is a bit ew atm, see what I can do?
         self.alldepths = [str(d) for d in sorted(self.core.keys())]
         #TODO: do we want to allow exclusion on computation plans, or not really?
@@ -880,7 +1241,10 @@ class ComputationDialog(wx.Dialog):
         sizer.Add(wx.StaticText(self, wx.ID_ANY, 'To Core "%s"' % self.core.name), 
                   (1, 0), (1, 2))
         #sizer.Add(self.depthpicker, (2, 0), (1, 2), flag=wx.EXPAND)
-        sizer.Add(bsz, (3, 1), flag=wx.ALIGN_RIGHT)
+        sizer.Add(self.profilecheck, (3, 0), (1, 2))
+        sizer.Add(wx.StaticText(self, wx.ID_ANY, "Ensemble Draws"), (4, 0))
+        sizer.Add(self.drawspin, (4, 1), flag=wx.EXPAND)
+        sizer.Add(bsz, (5, 1), flag=wx.ALIGN_RIGHT)
         sizer.AddGrowableRow(2)
         sizer.AddGrowableCol(1)
         self.SetSizer(sizer)
@@ -901,17 +1265,35 @@ class ComputationDialog(wx.Dialog):
     def depths(self):
         #TODO: fix this if some samples can be excluded...
         return self.alldepths
+    
+    @property
+    def use_cprofile(self):
+        return self.profilecheck.IsChecked()
+    
+    @property
+    def draws(self):
+        return self.drawspin.GetValue()
                 
 class WorkflowProgress(wx.Dialog):
+    columns = ('Component', 'Wall (s)', 'CPU (s)', 'Samples In', 
+               'Samples Out', 'Port', 'Memory')
+    
     def __init__(self, parent, title):
-        super(WorkflowProgress, self).__init__(parent, wx.ID_ANY, title)
+        super(WorkflowProgress, self).__init__(parent, wx.ID_ANY, title,
+                        style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
         
         #TODO: make this a real progress bar...
         self.bar = wx.Gauge(self, wx.ID_ANY)
+        #live per-component timings, filled in as each component finishes
+        self.timings = wx.ListCtrl(self, wx.ID_ANY, size=(560, 150),
+                                   style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        for index, label in enumerate(self.columns):
+            self.timings.InsertColumn(index, label)
         button = wx.Button(self, wx.ID_CANCEL, 'Abort')
         
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(self.bar, border=5, flag=wx.ALL | wx.EXPAND)
+        sizer.Add(self.timings, proportion=1, border=5, flag=wx.ALL | wx.EXPAND)
         sizer.Add(button, border=5, flag=wx.ALIGN_CENTER | wx.ALL)
         
         self.SetSizer(sizer)
@@ -927,6 +1309,27 @@ class WorkflowProgress(wx.Dialog):
 
     def on_finish(self, event):
         self.EndModal(wx.ID_OK)
+        
+    def add_record(self, record):
+        """
+        Shows the timings for one finished component invocation (a 
+        ComponentRun).
+        """
+        if not self:
+            #records can still arrive after an aborted run's dialog is gone
+            return
+        def show(value):
+            return 'N/A' if value is None else str(value)
+        index = self.timings.InsertStringItem(self.timings.GetItemCount(),
+                                              record.component)
+        for col, value in enumerate(('%.3f' % record.wall_time, 
+                                     '%.3f' % record.cpu_time,
+                                     show(record.samples_in), 
+                                     show(record.samples_out),
+                                     ', '.join(record.ports) or 'N/A',
+                                     show(record.memory_delta)), 1):
+            self.timings.SetStringItem(index, col, value)
+        self.timings.EnsureVisible(index)
 
 
 class AboutBox(wx.Dialog):
@@ -34,9 +34,10 @@ import wx.grid
 
 import csv
 from cscience import datastore
+from cscience.components import datastructures
 from cscience.GUI.Util import grid, FunctionValidator
 from cscience.GUI.Editors import MemoryFrame
-from cscience.GUI import events
+from cscience.GUI import dialogs, events
 
 class MilieuGridTable(grid.UpdatingTable):
     def __init__(self, *args, **kwargs):
@@ -191,11 +192,24 @@ class MilieuBrowser(MemoryFrame):
         dlg = CreateMilieu(self)
         if dlg.ShowModal() == wx.ID_OK:
             template = datastore.templates[dlg.template]
-            #TODO: handle errors!
             #TODO: waiting cursor!
-            with open(dlg.path, 'rU') as input_file:
-                coll = template.new_milieu(csv.DictReader(input_file, dlg.order))
+            try:
+                with open(dlg.path, 'rU') as input_file:
+                    coll, errors = template.load_milieu(csv.reader(input_file), 
+                                                        dlg.order)
+            except (IOError, ValueError) as exc:
+                wx.MessageBox('Could not load %s: %s' % (dlg.path, exc), 
+                              "Milieu Not Created", wx.OK | wx.ICON_ERROR)
+                dlg.Destroy()
+                return
+            if errors and not dialogs.confirm_bad_rows(errors, 
+                        "Problems Loading Milieu", 
+                        'Create the milieu without them?'):
+                dlg.Destroy()
+                return
             coll.name = dlg.name
+            #anything indexed from a milieu this replaces is stale now
+            datastructures.index_cache.invalidate(coll.name)
             datastore.milieus.add(coll)
             events.post_change(self, 'milieus', coll.name)
         dlg.Destroy()        
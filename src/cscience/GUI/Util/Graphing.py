@@ -27,11 +27,43 @@ Graphing.py
 * SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import itertools
-import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.backends.backend_wxagg as wxagg
 import wx
+import wx.lib.delayedresult
 
+from cscience.GUI import events
+
+def column(samples, att):
+    """
+    Returns the values of att for samples as a float array, with NaN where
+    the value is missing.
+    """
+    return np.array([sample[att] for sample in samples], dtype=float)
+
+def decimate(invar, var, low, high, buckets):
+    """
+    Picks out the points of a series (sorted by invar) that are worth drawing
+    when the invariant axis shows low to high across the given number of 
+    buckets (usually one per pixel): the smallest and largest var in each 
+    bucket, plus the nearest point outside the range on either side, so that
+    nothing visibly changes at the edges. Returns an array of indices.
+    """
+    start = max(np.searchsorted(invar, low, 'left') - 1, 0)
+    stop = min(np.searchsorted(invar, high, 'right') + 1, len(invar))
+    if stop - start <= 2 * buckets or high <= low:
+        return np.arange(start, stop)
+    bucket = np.floor((invar[start:stop] - low) * 
+                      (buckets / (high - low))).astype(int)
+    np.clip(bucket, -1, buckets, out=bucket)
+    order = np.lexsort((var[start:stop], bucket))
+    edges = np.flatnonzero(np.diff(bucket[order]))
+    firsts = np.concatenate(([0], edges + 1))
+    lasts = np.concatenate((edges, [len(order) - 1]))
+    return np.union1d(order[firsts], order[lasts]) + start
 
 class PlotOptions(object):
     def __init__(self, invaratt, **kwargs):
@@ -67,6 +99,77 @@ class PlotOptions(object):
         #TODO: should implement a max # of plot atts...
         return bool(self.varatts)
 
+class PlotSeries(object):
+    """
+    One attribute of one computation plan's samples, as plotted on one set of
+    axes. Holds the full series as arrays and draws only a decimated subset of
+    it, which is re-picked whenever the visible range of the invariant 
+    changes.
+    """
+    
+    def __init__(self, plot, invaraxis, fmt='bo'):
+        self.plot = plot
+        self.invaraxis = invaraxis
+        self.invar = self.var = np.empty(0)
+        self.ierr = self.verr = None
+        self.line, = plot.plot([], [], fmt, linestyle='None')
+        self.errorbars = LineCollection([], colors=self.line.get_color())
+        plot.add_collection(self.errorbars)
+        
+    def set_data(self, invar, var, ierr=None, verr=None):
+        """
+        Replaces the series' data (the artists are updated on the next 
+        decimate). Returns whether anything actually changed.
+        """
+        changed = not all([np.array_equal(old, new) for old, new in 
+                           zip((self.invar, self.var, self.ierr, self.verr), 
+                               (invar, var, ierr, verr))])
+        self.invar, self.var, self.ierr, self.verr = invar, var, ierr, verr
+        return changed
+    
+    def remove(self):
+        self.line.remove()
+        self.errorbars.remove()
+        
+    def xy(self, invar, var):
+        if self.invaraxis == 'y':
+            return var, invar
+        return invar, var
+    
+    def pixels(self):
+        if self.invaraxis == 'y':
+            return max(int(self.plot.bbox.height), 1)
+        return max(int(self.plot.bbox.width), 1)
+        
+    def decimate(self, low, high):
+        shown = decimate(self.invar, self.var, low, high, self.pixels())
+        invar = self.invar[shown]
+        var = self.var[shown]
+        self.line.set_data(*self.xy(invar, var))
+        
+        segments = []
+        if self.ierr is not None:
+            minus, plus = self.ierr[0][shown], self.ierr[1][shown]
+            segments.append(np.dstack(self.xy(np.column_stack((invar - minus, invar + plus)),
+                                              np.column_stack((var, var)))))
+        if self.verr is not None:
+            minus, plus = self.verr[0][shown], self.verr[1][shown]
+            segments.append(np.dstack(self.xy(np.column_stack((invar, invar)),
+                                              np.column_stack((var - minus, var + plus)))))
+        if segments:
+            self.errorbars.set_segments(np.concatenate(segments))
+            
+    def limits(self):
+        """
+        The (min, max) data limits of the full series, including errors.
+        """
+        invar, var = self.invar, self.var
+        if self.ierr is not None:
+            invar = np.concatenate((invar - self.ierr[0], invar + self.ierr[1]))
+        if self.verr is not None:
+            var = np.concatenate((var - self.verr[0], var + self.verr[1]))
+        return self.xy((invar.min(), invar.max()), (var.min(), var.max()))
+
 class SamplePlot(object):
     #use shapes for different attribute plots, colors for different computations,
     #so black/white printouts are as legible as possible.
@@ -74,29 +177,32 @@ class SamplePlot(object):
     colorseries = 'brgmyck'
     shapeseries = 's^ov*p+hxD'
     
-    def __init__(self, samples, options):
+    def __init__(self, samples, options, figure=None):
         #TODO: muck around with tick colors & positions to make what's being
         #displayed all supah clear!
         if not options.ok():
             raise TypeError('Cannot plot the current options zomg')
         self.options = options
-        #we don't want to plot any samples where the invariant doesn't actually
-        #exist, so we can filter those out now
-        self.samples = filter(lambda s: s[options.invaratt] is not None, samples)
         
-        #create the graphing figure and all the axes I want...
+        #create (or clear out) the graphing figure and all the axes I want...
+        self.figure = figure or Figure()
+        self.figure.clf()
+        count = len(self.options.varatts)
         if self.options.stacked:
-            argset = {}
-            if self.options.invaraxis == 'y':
-                argset['ncols'] = len(self.options.varatts)
-                argset['sharey'] = True
-            else:
-                argset['nrows'] = len(self.options.varatts)
-                argset['sharex'] = True
-            self.figure, self.plots = plt.subplots(**argset)
+            self.plots = []
+            for i in xrange(count):
+                argset = {}
+                if self.plots and self.options.invaraxis == 'y':
+                    argset['sharey'] = self.plots[0]
+                elif self.plots:
+                    argset['sharex'] = self.plots[0]
+                if self.options.invaraxis == 'y':
+                    position = (1, count, i + 1)
+                else:
+                    position = (count, 1, i + 1)
+                self.plots.append(self.figure.add_subplot(*position, **argset))
         else:
             #overlapping figures...
-            self.figure = plt.Figure()
             self.figure.add_subplot(1, 1, 1)
             plot = self.figure.get_axes()[0]
             argset = {'frameon':False}
@@ -104,64 +210,129 @@ class SamplePlot(object):
                 argset['sharey'] = plot
             else:
                 argset['sharex'] = plot
-            for i in xrange(1, len(self.options.varatts)):
+            for i in xrange(1, count):
                 #TODO: muck w/ axes...
                 self.figure.add_axes(plot.get_position(True), 
                                                        **argset)
             self.plots = self.figure.get_axes()
+        
+        for plot in self.plots:
+            if self.options.invaraxis == 'y':
+                plot.callbacks.connect('ylim_changed', self.on_zoom)
+            else:
+                plot.callbacks.connect('xlim_changed', self.on_zoom)
                 
-        print self.plots, self.options.varatts, self.options.varerrs
-        for vatt, err, plot in zip(self.options.varatts, self.options.varerrs, self.plots):
-            self.samples.sort(key=lambda s: (s['computation plan'], s[self.options.invaratt]))
-            for cplan, sampleset in itertools.groupby(self.samples, key=lambda s: s['computation plan']):
-                args = self.extract_graph_series(sampleset, vatt, err)
-                print args
-                #TODO: format should changes yo
-                if self.options.invaraxis == 'y':
-                    plot.errorbar(x=args['var'], y=args['invar'], 
-                                  xerr=args['verr'], yerr=args['ierr'], fmt='bo')
-                else:
-                    plot.errorbar(y=args['var'], x=args['invar'], 
-                                  yerr=args['verr'], xerr=args['ierr'], fmt='bo')
-                #TODO: annotate points w/ their depth, if depth is not the invariant
-                #SRS TODO: make sure there is a legend for all this foofrah
-                #TODO: x label, y label, title...
+        #(attribute index, computation plan) -> PlotSeries
+        self.series = {}
+        #computation plan -> style number, so a plan keeps its look as plans
+        #come and go
+        self.styles = {}
+        self.set_samples(samples)
         #TODO: get this thing working.
         #plt.tight_layout()
         
-    def extract_graph_series(self, sampleset, att, err):
-        plotargs = {'invar':[], 'var':[], 'depth':[], 'ierr':None, 'verr':None}
-        if self.options.invarerr:
-            plotargs['ierr'] = []
-            def ierr(s):
-                plotargs['ierr'].append((s[self.options.invarerr[0]] or 0, 
-                                         s[self.options.invarerr[1]] or 0))
-        else:
-            def ierr(s):
-                pass
-        if err:
-            plotargs['verr'] = []
-            def verr(s):
-                plotargs['verr'].append((s[err[0]] or 0, s[err[1]] or 0))
-        else:
-            def verr(s):
-                pass
+    def set_samples(self, samples):
+        """
+        Plots samples, updating the data of the existing series in place and
+        adding or removing series as computation plans come and go. Returns
+        the set of axes whose data changed.
+        """
+        #pull everything needed out of the samples once, as arrays; we don't
+        #want to plot any samples where the invariant doesn't actually exist,
+        #so those are filtered out now
+        invar = column(samples, self.options.invaratt)
+        present = np.flatnonzero(~np.isnan(invar))
+        samples = [samples[index] for index in present]
+        invar = invar[present]
+        cplans, groups = np.unique([s['computation plan'] for s in samples], 
+                                   return_inverse=True)
+        order = np.lexsort((invar, groups))
+        self.samples = [samples[index] for index in order]
+        self.invar = invar[order]
+        self.groups = groups[order]
+        self.cplans = cplans
+        
+        changed = set()
+        current = set()
+        for index, (vatt, err, plot) in enumerate(zip(self.options.varatts, 
+                                                      self.options.varerrs, 
+                                                      self.plots)):
+            for group, cplan in enumerate(self.cplans):
+                args = self.extract_graph_series(group, vatt, err)
+                if not len(args['invar']):
+                    continue
+                key = (index, cplan)
+                current.add(key)
+                if key not in self.series:
+                    style = self.styles.setdefault(cplan, len(self.styles))
+                    if self.options.stacked:
+                        fmt = self.colorseries[index % len(self.colorseries)] + \
+                              self.shapeseries[style % len(self.shapeseries)]
+                    else:
+                        fmt = self.colorseries[style % len(self.colorseries)] + \
+                              self.shapeseries[index % len(self.shapeseries)]
+                    self.series[key] = PlotSeries(plot, self.options.invaraxis, 
+                                                  fmt)
+                if self.series[key].set_data(args['invar'], args['var'],
+                                             args['ierr'], args['verr']):
+                    changed.add(plot)
+                #TODO: annotate points w/ their depth, if depth is not the invariant
+                #SRS TODO: make sure there is a legend for all this foofrah
+                #TODO: x label, y label, title...
+        for key in set(self.series) - current:
+            series = self.series.pop(key)
+            series.remove()
+            changed.add(series.plot)
             
-        for s in sampleset:
-            if s[self.options.invaratt] is None or s[att] is None:
-                continue
-            plotargs['invar'].append(s[self.options.invaratt])
-            plotargs['var'].append(s[att])
-            plotargs['depth'].append(s['depth'])
-            ierr(s)
-            verr(s)
+        for plot in changed:
+            self.autoscale(plot)
+        return changed
+        
+    def autoscale(self, plot):
+        #decimated artists don't know the extent of their full data, so the
+        #limits are set from the series directly
+        limits = [series.limits() for series in self.series.itervalues() 
+                  if series.plot is plot]
+        if limits:
+            xlims, ylims = zip(*limits)
+            plot.ignore_existing_data_limits = True
+            plot.update_datalim([(min(x[0] for x in xlims), min(y[0] for y in ylims)),
+                                 (max(x[1] for x in xlims), max(y[1] for y in ylims))])
+            plot.autoscale_view()
             
-        #change [(-, +), (-, +)...] to ([-, -, ...], [+, +, ...] since that's
-        #the matplotlib format
+    def on_zoom(self, plot):
+        """
+        Re-picks the points drawn for every series once the visible range of
+        the invariant changes (axes sharing the invariant all change together).
+        """
+        if self.options.invaraxis == 'y':
+            low, high = sorted(plot.get_ylim())
+        else:
+            low, high = sorted(plot.get_xlim())
+        for series in self.series.itervalues():
+            series.decimate(low, high)
+        
+    def extract_graph_series(self, group, att, err):
+        """
+        Returns arrays of the invariant, att, and errors (as (minus, plus)
+        pairs of arrays, or None) for the samples of the group'th computation
+        plan that have a value for att.
+        """
+        rows = np.flatnonzero(self.groups == group)
+        samples = [self.samples[index] for index in rows]
+        var = column(samples, att)
+        present = ~np.isnan(var)
+        samples = [sample for sample, keep in zip(samples, present) if keep]
+        plotargs = {'invar':self.invar[rows][present], 'var':var[present], 
+                    'ierr':None, 'verr':None}
+        
+        #missing errors are plotted as 0
         if self.options.invarerr:
-            plotargs['ierr'] = zip(*plotargs['ierr'])
+            plotargs['ierr'] = [np.nan_to_num(column(samples, name)) 
+                                for name in self.options.invarerr]
         if err:
-            plotargs['verr'] = zip(*plotargs['verr'])
+            plotargs['verr'] = [np.nan_to_num(column(samples, name)) 
+                                for name in err]
         return plotargs
     
 class PlotWindow(wx.Frame):
@@ -173,12 +344,165 @@ class PlotWindow(wx.Frame):
         sizer.Add(self.canvas, flag=wx.ALL | wx.EXPAND, proportion=1, border=10)
         self.SetSizer(sizer)
         #TODO: can add lots of awesome menus & similar here now!
+        
+        #keep following whatever samples the browser is displaying
+        events.subscribe('displayed samples', self.on_samples_changed)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.on_destroy)
+        
+    def on_samples_changed(self, samples):
+        #nothing displayed clears the plot, but keeps the title
+        if samples:
+            self.SetTitle(samples[0]['core'])
+        self.canvas.update_samples(samples)
+            
+    def on_destroy(self, event):
+        if event.GetEventObject() is self:
+            events.unsubscribe('displayed samples', self.on_samples_changed)
+        event.Skip()
 
 class PlotCanvas(wxagg.FigureCanvasWxAgg):
+    """
+    Canvas that builds and rasterizes its plot on a worker thread, showing a
+    placeholder until there is something to blit. Only one render runs at a
+    time; requests made while one is running are picked up when it finishes,
+    and renders started before the samples or options changed are thrown 
+    away.
+    
+    The plot lives in its own off-screen figure, which only the worker ever
+    touches; the figure wx knows about (and resizes) is never drawn.
+    """
+    placeholder = "Rendering plot..."
+    failed = "Could not draw this plot"
     
     def __init__(self, parent, samples, options):
-        self.plot = SamplePlot(samples, options)
-        super(PlotCanvas, self).__init__(parent, wx.ID_ANY, self.plot.figure)
+        self.plot = None
+        #(samples, options) still to be plotted
+        self.build = (samples, options)
+        self.generation = 0
+        self.rendering = False
+        self.pending = False
+        #whether the figure needs drawing even if the plotted data is the same
+        self.redraw = True
+        self.aborting = wx.lib.delayedresult.AbortEvent()
+        super(PlotCanvas, self).__init__(parent, wx.ID_ANY, Figure())
         
-
-    
+    def set_options(self, samples, options):
+        """
+        Replots the canvas from scratch for new samples and/or options.
+        """
+        self.build = (samples, options)
+        self.generation += 1
+        self.aborting.set()
+        self._isDrawn = False
+        self.draw()
+        
+    def update_samples(self, samples):
+        """
+        Replots the current options for a new set of samples, updating the 
+        existing plot in place; the figure is only drawn again if the plotted
+        data actually changed.
+        """
+        options = self.build[1] if self.build else self.plot.options
+        self.build = (samples, options)
+        self.generation += 1
+        self.aborting.set()
+        self.request_render()
+        
+    def draw(self, drawDC=None):
+        if not self._isDrawn:
+            self.show_placeholder(drawDC)
+        self.redraw = True
+        self.request_render()
+            
+    def show_placeholder(self, drawDC=None, text=None):
+        width, height = self.GetClientSize()
+        self.bitmap = wx.EmptyBitmap(max(width, 1), max(height, 1))
+        dc = wx.MemoryDC(self.bitmap)
+        dc.SetBackground(wx.WHITE_BRUSH)
+        dc.Clear()
+        dc.DrawLabel(text or self.placeholder, wx.Rect(0, 0, width, height), 
+                     wx.ALIGN_CENTER)
+        dc.SelectObject(wx.NullBitmap)
+        self.gui_repaint(drawDC=drawDC)
+        
+    def request_render(self):
+        if self.rendering:
+            self.pending = True
+        else:
+            self.start_render()
+        
+    def start_render(self):
+        self.rendering = True
+        self.pending = False
+        self.aborting = wx.lib.delayedresult.AbortEvent()
+        width, height = self.GetClientSize()
+        wx.lib.delayedresult.startWorker(self.show_render, self.render,
+                            wargs=(self.build, self.redraw, 
+                                   (max(width, 1), max(height, 1)), 
+                                   self.aborting), 
+                            cargs=(self.generation,))
+        self.redraw = False
+        
+    def render(self, build, redraw, size, aborting):
+        """
+        Plots build (if given), reusing the current plot when the options are
+        the same, and draws the plot's figure at size (in pixels) with Agg if
+        anything changed or redraw is set; runs on a worker thread. Returns 
+        the plot and the rendered image as (width, height, RGB string) or None
+        if there was nothing to draw, or None if aborted.
+        """
+        plot = self.plot
+        if build and plot is not None and build[1] is plot.options:
+            changed = plot.set_samples(build[0])
+        elif build:
+            plot = SamplePlot(build[0], build[1])
+            FigureCanvasAgg(plot.figure)
+            changed = True
+        else:
+            changed = False
+        if aborting():
+            return None
+        
+        figure = plot.figure
+        size = (size[0] / figure.dpi, size[1] / figure.dpi)
+        if tuple(figure.get_size_inches()) != size:
+            figure.set_size_inches(size)
+            changed = True
+        if not (changed or redraw):
+            return plot, None
+        #decimate for the current size before drawing
+        plot.on_zoom(plot.plots[0])
+        figure.canvas.draw()
+        renderer = figure.canvas.get_renderer()
+        return plot, (int(renderer.width), int(renderer.height), 
+                      renderer.tostring_rgb())
+        
+    def show_render(self, dresult, generation):
+        if not self:
+            #window closed while rendering
+            return
+        self.rendering = False
+        try:
+            result = dresult.get()
+        except Exception as exc:
+            print "problem rendering plot:", exc
+            self._isDrawn = False
+            self.show_placeholder(text=self.failed)
+            if generation != self.generation:
+                #something newer was asked for, which may well work
+                self.start_render()
+            return
+        if result is None or generation != self.generation:
+            #stale; the newest samples and options still need drawing
+            self.pending = True
+            self.redraw = True
+        else:
+            self.plot, image = result
+            self.build = None
+            if image is not None:
+                width, height, data = image
+                self.bitmap = wx.BitmapFromBuffer(width, height, data)
+                self._isDrawn = True
+                self.gui_repaint()
+        if self.pending:
+            self.start_render()
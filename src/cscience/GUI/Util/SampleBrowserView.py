@@ -35,6 +35,7 @@ class SampleBrowserView(object):
     filter_key = "windows/samplebrowser/filter"
     primary_key = "windows/samplebrowser/primary"
     secondary_key = "windows/samplebrowser/secondary"
+    tertiary_key = "windows/samplebrowser/tertiary"
     direction_key = "windows/samplebrowser/direction"
 
     def __init__(self):
@@ -43,6 +44,8 @@ class SampleBrowserView(object):
         self.filter = config.Read(SampleBrowserView.filter_key, "<No Filter>")
         self.primary = config.Read(SampleBrowserView.primary_key, "depth")
         self.secondary = config.Read(SampleBrowserView.secondary_key, "computation plan")
+        #empty for no third sort key
+        self.tertiary = config.Read(SampleBrowserView.tertiary_key, "")
         self.direction = config.Read(SampleBrowserView.direction_key, "Ascending")
 
     #TODO: make these all properties, yo
@@ -75,6 +78,20 @@ class SampleBrowserView(object):
         self.secondary = new_secondary
         wx.Config.Get().Write(SampleBrowserView.secondary_key, new_secondary)
 
+    def get_tertiary(self):
+        return self.tertiary
+
+    def set_tertiary(self, new_tertiary):
+        self.tertiary = new_tertiary
+        wx.Config.Get().Write(SampleBrowserView.tertiary_key, new_tertiary)
+        
+    def get_sort_keys(self):
+        """
+        Returns the attributes to sort on, most significant first.
+        """
+        return [key for key in (self.primary, self.secondary, self.tertiary)
+                if key]
+
     def get_direction(self):
         return self.direction
 
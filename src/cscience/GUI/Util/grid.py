@@ -78,21 +78,45 @@ class UpdatingTable(wx.grid.PyGridTableBase):
 
 class LabelSizedGrid(wx.grid.Grid):
     
+    #at most this many rows are measured when sizing columns; they're spread
+    #over the whole grid, and the rest are assumed to be similar
+    sample_rows = 100
+    cell_padding = 12
+    
     def __init__(self, *args, **kwargs):
         self._selected_rows = set()
+        #column label -> widest content seen in that column so far
+        self._col_widths = {}
         super(LabelSizedGrid, self).__init__(*args, **kwargs)
-        self.SetDefaultRenderer(FancyTextRenderer())
+        #kept so AutoSize can measure cells the way they're drawn
+        self.renderer = TextRenderer()
+        self.SetDefaultRenderer(self.renderer)
         self.RegisterDataType('string', wx.grid.GridCellStringRenderer(),
                               wx.grid.GridCellAutoWrapStringEditor())
         self.RegisterDataType('boolean', wx.grid.GridCellBoolRenderer(),
                               wx.grid.GridCellBoolEditor())
         
         self.Bind(wx.grid.EVT_GRID_RANGE_SELECT, self.OnRangeSelect, self)
-    
+        
+    def sampled_rows(self):
+        count = self.GetNumberRows()
+        if count <= self.sample_rows:
+            return range(count)
+        step = float(count) / self.sample_rows
+        return sorted(set([int(index * step) for index in 
+                           range(self.sample_rows)] + [count - 1]))
+        
     def AutoSize(self):
+        """
+        Sizes row and column labels to fit, and columns to fit their label and
+        a sample of their contents; the cost doesn't grow with the number of
+        rows. Columns never get narrower than they've been sized before for 
+        the same label, so widths don't jump around as rows come and go.
+        """
+        rows = self.sampled_rows()
         # set row and column label cells to fit cell contents.
         width = max([self.GetTextExtent(self.GetRowLabelValue(i))[0] for i in 
-                     range(self.GetNumberRows())])
+                     rows] or [0])
         width = (width or 30) + 20
         self.SetRowLabelSize(width)
         
@@ -100,12 +124,21 @@ class LabelSizedGrid(wx.grid.Grid):
         #not account for. So, we need to count both max extent and max no. of
         #lines for proper sizing
         clabels = [self.GetColLabelValue(i) for i in range(self.GetNumberCols())]
-        height = max([self.GetTextExtent(lab)[1] for lab in clabels])
-        lines = max([lab.count('\n') + 1 for lab in clabels])
+        height = max([self.GetTextExtent(lab)[1] for lab in clabels] or [0])
+        lines = max([lab.count('\n') + 1 for lab in clabels] or [0])
         totalh = (height * lines or 30) + 20
         self.SetColLabelSize(totalh)
         
-        super(LabelSizedGrid, self).AutoSize()
+        dc = wx.ClientDC(self)
+        dc.SetFont(self.GetDefaultCellFont())
+        self.BeginBatch()
+        for col, label in enumerate(clabels):
+            width = max([self.GetTextExtent(line)[0] for line in label.split('\n')] +
+                        [self.renderer.extent(dc, self.GetCellValue(row, col))[0]
+                         for row in rows] + [self._col_widths.get(label, 0)])
+            self._col_widths[label] = width
+            self.SetColSize(col, width + self.cell_padding)
+        self.EndBatch()
         
         # The scroll bars aren't resized automatically (at least on windows)
         self.AdjustScrollbars()
@@ -132,14 +165,42 @@ class LabelSizedGrid(wx.grid.Grid):
         return sorted(list(self._selected_rows))
     
 
-#TODO: what does this actually accomplish?
-class FancyTextRenderer(wx.grid.PyGridCellRenderer):
+class TextRenderer(wx.grid.PyGridCellRenderer):
+    """
+    Draws cell values as plain text, which is what nearly all of them are;
+    values that contain fancytext markup (tags like <sup>) are drawn with
+    wx.lib.fancytext instead. Text extents are cached per (font, text), since
+    the same values get measured over and over as the grid repaints and sizes
+    itself.
+    """
+    
+    #(font description, text) -> (width, height)
+    _extents = {}
+    max_extents = 10000
+    
     def __init__(self):
         wx.grid.PyGridCellRenderer.__init__(self)
         
+    @staticmethod
+    def has_markup(text):
+        return '<' in text and '>' in text
+        
+    def extent(self, dc, text):
+        key = (dc.GetFont().GetNativeFontInfoDesc(), text)
+        try:
+            return self._extents[key]
+        except KeyError:
+            if len(self._extents) > self.max_extents:
+                self._extents.clear()
+            if self.has_markup(text):
+                size = wx.lib.fancytext.GetExtent(text, dc)
+            else:
+                size = dc.GetMultiLineTextExtent(text)[:2]
+            self._extents[key] = size
+            return size
+        
     def Draw(self, grid, attr, dc, rect, row, col, isSelected):
         text = grid.GetCellValue(row, col)
-        hAlign, vAlign = attr.GetAlignment()
         dc.SetFont(attr.GetFont())
         if isSelected:
             bg = grid.GetSelectionBackground()
@@ -153,7 +214,10 @@ class FancyTextRenderer(wx.grid.PyGridCellRenderer):
         dc.SetBrush(wx.Brush(bg, wx.SOLID))
         dc.SetPen(wx.TRANSPARENT_PEN)
         dc.DrawRectangleRect(rect)
-        wx.lib.fancytext.RenderToDC(text, dc, rect.x + 2, rect.y + 2)
+        if self.has_markup(text):
+            wx.lib.fancytext.RenderToDC(text, dc, rect.x + 2, rect.y + 2)
+        else:
+            dc.DrawText(text, rect.x + 2, rect.y + 2)
         dc.DestroyClippingRegion()
         
     def GetBestSize(self, grid, attr, dc, row, col):
@@ -163,13 +227,9 @@ class FancyTextRenderer(wx.grid.PyGridCellRenderer):
             Note: You _must_ return a wxSize object.  Returning a two-value-tuple
             won't raise an error, but the value won't be respected by wxPython.
             """
-            x, y = wx.lib.fancytext.GetExtent(grid.GetCellValue(row, col), dc)
-            # note that the two-tuple returned by GetTextExtent won't work,
-            # need to give a wxSize object back!
+            dc.SetFont(attr.GetFont())
+            x, y = self.extent(dc, grid.GetCellValue(row, col))
             return wx.Size(x, y)
 
     def Clone(self):
-        return FancyTextRenderer()
-        
-
-        
\ No newline at end of file
+        return TextRenderer()
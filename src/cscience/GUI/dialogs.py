@@ -36,6 +36,27 @@ import wx.lib.hyperlink
 from cscience.framework import samples
 from cscience.GUI import events
 
+def confirm_bad_rows(errors, title, question, shown=15):
+    """
+    Lists the problems found reading a file of rows (as (row number, column,
+    value) tuples; see samples.read_columns) and asks the user question, 
+    which should be whether to go ahead without the rows they're in. 
+    Returns True if the user said yes.
+    """
+    lines = []
+    for number, column, value in errors[:shown]:
+        if column is None:
+            lines.append('Row %d: too few columns' % (number + 1))
+        else:
+            lines.append('Row %d: %r is not a valid value for %s' % 
+                         (number + 1, value, column))
+    if len(errors) > shown:
+        lines.append('...and %d more' % (len(errors) - shown))
+    rows = len(set([error[0] for error in errors]))
+    return wx.MessageBox('%d rows could not be read:\n\n%s\n\n%s' % 
+                         (rows, '\n'.join(lines), question), title,
+                         wx.YES_NO | wx.ICON_EXCLAMATION) == wx.YES
+
 def field_dialog(name, query_name):
     #TODO: this might be better done with a metaclass? not sure.
     class EditField(wx.Dialog):
@@ -34,6 +34,31 @@ WorkflowDoneEvent, EVT_WORKFLOW_DONE = wx.lib.newevent.NewEvent()
 #command events propagate! yay!
 RepoChangedEvent, EVT_REPO_CHANGED = wx.lib.newevent.NewCommandEvent()
 
+#kind of change -> callbacks to notify of it; see subscribe
+_listeners = {}
+
+def subscribe(changed, callback):
+    """
+    Registers callback(value) to be called whenever a change of the given kind
+    is posted or notified, for listeners (like plot windows) that aren't in 
+    the path of the change event.
+    """
+    _listeners.setdefault(changed, []).append(callback)
+    
+def unsubscribe(changed, callback):
+    try:
+        _listeners[changed].remove(callback)
+    except (KeyError, ValueError):
+        pass
+    
+def notify(changed, value=None):
+    """
+    Calls all the callbacks subscribed to changed, without posting an event.
+    """
+    for callback in list(_listeners.get(changed, ())):
+        callback(value)
+
 def post_change(window, changed, value=None):
     wx.PostEvent(window, RepoChangedEvent(window.GetId(), changed=changed,
                                           value=value))
+    notify(changed, value)
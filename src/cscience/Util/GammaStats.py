@@ -27,76 +27,157 @@ GammaStats.py
 * SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import math
+import numpy as np
+
+class ConvergenceError(ArithmeticError):
+    """Raised when a series or continued fraction fails to converge."""
+    pass
+
+def _values(*args):
+    """
+    Returns args as broadcast float arrays, plus whether they were all 
+    scalars (in which case results should be handed back as plain floats).
+    """
+    scalar = all([np.ndim(arg) == 0 for arg in args])
+    return [np.atleast_1d(np.array(arg, dtype=float)) for arg in 
+            np.broadcast_arrays(*args)] + [scalar]
+
+def _result(values, scalar):
+    return float(values[0]) if scalar else values
 
 def gammq(a, x):
-    """Incomplete gamma function."""
-    if (x < 0. or a <= 0.):
-        raise ValueError, repr((a, x))
-    if (x < a + 1.):
-        return 1. - gser(a, x)[0]
-    else:
-        return gcf(a, x)[0]
+    """
+    Incomplete gamma function Q(a, x) = 1 - P(a, x). a and x may be numbers 
+    or arrays (which are broadcast against each other).
+    """
+    a, x, scalar = _values(a, x)
+    if np.any(x < 0.) or np.any(a <= 0.) or np.any(np.isnan(a + x)):
+        raise ValueError('gammq needs x >= 0 and a > 0; got a=%r, x=%r' % (a, x))
+    result = np.empty(a.shape)
+    series = x < a + 1.
+    if series.any():
+        result[series] = 1. - gser(a[series], x[series])[0]
+    if not series.all():
+        result[~series] = gcf(a[~series], x[~series])[0]
+    return _result(result, scalar)
 
 def gser(a, x, itmax=700, eps=3.e-7):
-    """Series approx'n to the incomplete gamma function."""
+    """
+    Series approx'n to the incomplete gamma function P(a, x); returns 
+    (P(a, x), ln(gamma(a))).
+    """
+    a, x, scalar = _values(a, x)
+    if np.any(x < 0.):
+        raise ValueError('gser needs x >= 0; got %r' % x)
     gln = gammln(a)
-    if (x < 0.):
-            raise bad_arg, x
-    if (x == 0.):
-            return(0.)
-    ap = a
-    sum = 1. / a
-    delta = sum
+    ap = a.copy()
+    total = 1. / a
+    delta = total.copy()
+    #x == 0 is exactly 0, and needs no iterating
+    active = x > 0.
     n = 1
-    while n <= itmax:
-            ap = ap + 1.
-            delta = delta * x / ap
-            sum = sum + delta
-            if (abs(delta) < abs(sum) * eps):
-                    return (sum * math.exp(-x + a * math.log(x) - gln), gln)
-            n = n + 1
-    raise max_iters, str((abs(delta), abs(sum) * eps))
+    while n <= itmax and active.any():
+        ap[active] += 1.
+        delta[active] *= x[active] / ap[active]
+        total[active] += delta[active]
+        active &= ~(np.abs(delta) < np.abs(total) * eps)
+        n = n + 1
+    if active.any():
+        raise ConvergenceError('gser did not converge for a=%r, x=%r' % 
+                               (a[active], x[active]))
+    with np.errstate(divide='ignore'):
+        result = np.where(x > 0., 
+                          total * np.exp(-x + a * np.log(x) - gln), 0.)
+    return (_result(result, scalar), _result(gln, scalar))
 
 def gammln(xx):
-    """Logarithm of the gamma function."""
-    global gammln_cof, gammln_stp
-    gammln_cof = [76.18009173, -86.50532033, 24.01409822, -1.231739516e0, 0.120858003e-2, -0.536382e-5]
-    gammln_stp = 2.50662827465
+    """Logarithm of the gamma function (of a number or an array)."""
+    xx, scalar = _values(xx)
     x = xx - 1.
     tmp = x + 5.5
-    tmp = (x + 0.5) * math.log(tmp) - tmp
-    ser = 1.
-    for j in range(6):
-            x = x + 1.
-            ser = ser + gammln_cof[j] / x
-    return tmp + math.log(gammln_stp * ser)
+    tmp = (x + 0.5) * np.log(tmp) - tmp
+    ser = np.ones(xx.shape)
+    for coefficient in gammln_cof:
+        x = x + 1.
+        ser = ser + coefficient / x
+    return _result(tmp + np.log(gammln_stp * ser), scalar)
+
+gammln_cof = [76.18009173, -86.50532033, 24.01409822, -1.231739516e0, 0.120858003e-2, -0.536382e-5]
+gammln_stp = 2.50662827465
 
 def gcf(a, x, itmax=200, eps=3.e-7):
-    """Continued fraction approx'n of the incomplete gamma function."""
+    """
+    Continued fraction approx'n of the incomplete gamma function Q(a, x); 
+    returns (Q(a, x), ln(gamma(a))).
+    """
+    a, x, scalar = _values(a, x)
     gln = gammln(a)
-    gold = 0.
-    a0 = 1.
-    a1 = x
-    b0 = 0.
-    b1 = 1.
-    fac = 1.
+    gold = np.zeros(a.shape)
+    g = np.zeros(a.shape)
+    a0 = np.ones(a.shape)
+    a1 = x.copy()
+    b0 = np.zeros(a.shape)
+    b1 = np.ones(a.shape)
+    fac = np.ones(a.shape)
+    active = np.ones(a.shape, dtype=bool)
     n = 1
-    while n <= itmax:
-            an = n
-            ana = an - a
-            a0 = (a1 + a0 * ana) * fac
-            b0 = (b1 + b0 * ana) * fac
-            anf = an * fac
-            a1 = x * a0 + anf * a1
-            b1 = x * b0 + anf * b1
-            if (a1 != 0.):
-                    fac = 1. / a1
-                    g = b1 * fac
-                    if (abs((g - gold) / g) < eps):
-                            return (g * math.exp(-x + a * math.log(x) - gln), gln)
-                    gold = g
-            n = n + 1
-    raise max_iters, str(abs((g - gold) / g))
+    while n <= itmax and active.any():
+        ana = n - a
+        a0 = np.where(active, (a1 + a0 * ana) * fac, a0)
+        b0 = np.where(active, (b1 + b0 * ana) * fac, b0)
+        anf = n * fac
+        a1 = np.where(active, x * a0 + anf * a1, a1)
+        b1 = np.where(active, x * b0 + anf * b1, b1)
+        step = active & (a1 != 0.)
+        fac = np.where(step, 1. / np.where(step, a1, 1.), fac)
+        g = np.where(step, b1 * fac, g)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            converged = step & (np.abs((g - gold) / g) < eps)
+        gold = np.where(step, g, gold)
+        active &= ~converged
+        n = n + 1
+    if active.any():
+        raise ConvergenceError('gcf did not converge for a=%r, x=%r' % 
+                               (a[active], x[active]))
+    with np.errstate(divide='ignore'):
+        result = g * np.exp(-x + a * np.log(x) - gln)
+    return (_result(result, scalar), _result(gln, scalar))
+
+def chisq_probability(chisq, dof):
+    """
+    Probability that a chi-square value at least as large as chisq would 
+    arise by chance with dof degrees of freedom (numbers or arrays).
+    """
+    chisq, dof, scalar = _values(chisq, dof)
+    return _result(gammq(0.5 * dof, 0.5 * chisq), scalar)
+
+def mswd(values, errors):
+    """
+    Scores how well each group of measurements agrees with its weighted mean.
+    values and errors (1 sigma) are arrays with one row per group and one 
+    column per measurement; pad groups with fewer measurements with NaN.
+    
+    Returns arrays (weighted mean, MSWD, probability) with one entry per 
+    group, where probability is the chance of a scatter at least this large
+    if the measurements really agree. Groups with fewer than two 
+    measurements get NaN MSWD and probability.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    errors = np.atleast_2d(np.asarray(errors, dtype=float))
+    present = ~(np.isnan(values) | np.isnan(errors))
+    weights = np.where(present, 1. / np.where(present, errors, 1.) ** 2, 0.)
+    values = np.where(present, values, 0.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (weights * values).sum(axis=1) / weights.sum(axis=1)
+        chisq = (weights * (values - mean[:, np.newaxis]) ** 2).sum(axis=1)
+        dof = present.sum(axis=1) - 1.
+        score = chisq / dof
+    probability = np.empty(len(values))
+    probability.fill(np.nan)
+    scored = dof > 0
+    if scored.any():
+        probability[scored] = chisq_probability(chisq[scored], dof[scored])
+    score[~scored] = np.nan
+    return mean, score, probability
 
 # vim: ts=4:sw=4:et
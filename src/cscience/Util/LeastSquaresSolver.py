@@ -27,7 +27,7 @@ LeastSquaresSolver.py
 * SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import math
+import numpy as np
 
 class LeastSquaresSolver(object):
     """A dense matrix linear least squares solver.
@@ -35,146 +35,82 @@ class LeastSquaresSolver(object):
     The problem is to find an x which minimizes the Euclidean norm || A * x - b
     ||, where A is an m by n matrix and b is a vector in R<sup>m</sup>.
 
-    Author Marek Rychlik (rychlik@u.arizona.edu)
-
-    Translated into Python by Ken Anderson (kena@cs.colorado.edu)
+    Originally a translation of the Numerical Recipes QR solver by Marek 
+    Rychlik (rychlik@u.arizona.edu) into Python by Ken Anderson 
+    (kena@cs.colorado.edu); now done with NumPy, with a batched version for
+    solving many systems of the same shape at once.
     """
-
-    #  param a: a number.
-    #  param b: the number determining the sign of the result.
-    #  returns a number equal in magnitude to the first argument, whose sign is that of the second argument.
-    def copySign(self, a, b):
-        if b >= 0.0:
-            return abs(a)
-        else:
-            return -abs(a)
-
-    #  Square a number carefully.
-    #
-    #  param a: a number
-    #  returns the value of a squared.
-    def square(self, a):
-        # This is most likely not needed in correctly implemented Java
-        # Note: not sure if this is needed in python...
-        #     : going to leave it in for now
-        if a == 0.0:
-            return 0.0
-        else:
-            return a * a
-
-    #  The qrdcmp method finds the QR decomposition of a matrix A, which is not
-    #  assumed to be square, but m x n. We do it by a slight modification of the algorithm of
-    #  Numerical Recipes in C. Thus 
-    #
-    #                R = Q_n-1 * Q_n-2 * Q_n-2 * ... * Q_0 * A
-    #
-    #  where:
-    #
-    #                Q_j are Housholder matrices Q_j = I - u_j * u_j T c_j.
-    #
-    #  The vectors u_j are stored in columns of A on and below the main diagonal.
-    #  
-    #  The diagonal entries of R are stored in d[n].
-    #
-    #  This code is an adaptation of the code in Numerical Recipes, but the
-    #  "optimization" was removed which prevents the code from working when the number of equations
-    #  exceeds the number of unknowns.
-    # 
-    #  param a: Array holding the matrix A
-    #  param c: Array holding the coefficients c_j
-    #  param d: Array to hold the diagonal of R
-    #  return true if the columns of a are linearly dependent, false otherwise
-    def qrdcmp(self, m, n, a, c, d):
-        sing = False
-        
-        for k in range(n):
-            scale = 0.0
-            for i in range(k, n):
-                scale = max(scale, abs(a[i][k]))
-            if scale == 0.0:
-                sing = True
-                c[k] = 0.0
-                d[k] = 0.0
-            else:
-                for i in range(k, m):
-                    a[i][k] /= scale
-                total = 0.0
-                for i in range(k, m):
-                    total += self.square(a[i][k])
-                sigma = self.copySign(math.sqrt(total), a[k][k])
-                a[k][k] += sigma
-                # Norm of the k-th column magically appears to be this:
-                c[k] = sigma * a[k][k]
-                d[k] = -scale * sigma
-                # Find (I - 2 * a[k] * a[k]^T) * a[j]
-                for j in range(k + 1, n):
-                    total = 0.0
-                    for i in range(k, m):
-                        total += a[i][k] * a[i][j]
-                    tau = total / c[k]
-                    for i in range(k, m):
-                        a[i][j] -= tau * a[i][k]
-        return sing
-
-    #  The qrsolv method solves the equation A * x = b by least squares. The matrix a
-    #  is assumed to be transformed by qrdcmp and c and d are returned by that
-    #  algorithm.
-    #  
-    #  param a: array holding A
-    #  param c: array holding C
-    #  param d: array holding d, the diagonal of R - the upper-triangular part of A
-    #  param b: array holding B
     
-    def qrsolv(self, m, n, a, c, d, b):
-        # set b to Q^t*b
-        for j in range(n):
-            # Apply the j-th Housholder transformation I - 2 * a[j] * a[j]^T to b
-            total = 0.0
-            for i in range(j, m):
-                total += a[i][j] * b[i]
-            # Now total = a[j]^T * b, which is a number
-            tau = total / c[j]
-            for i in range(j, m):
-                b[i] -= tau * a[i][j]
-        # Solve R * x = b and set b := x
-        self.rsolv(n, a, d, b);
-        
-    # The rsolv method solves R * x = b, where R is upper-triangular. R is stored in
-    # the upper-triangular part of a matrix a, with the exception of the diagonal
-    # entries, which are stored in d
-    #
-    # param a: The coefficient matrix preprocessed with qrdcmp
-    # param d: The diagonal of R returned by qrdcmp
-    # param b: The vector b returned by qrsolv, equal
-    # to Q^T * b, where b is the original vector of right-hand sides.
-    def rsolv(self, n, a, d, b):
-        b[n - 1] /= d[n - 1]
-        for i in range(n - 2, -1, -1):
-            total = b[i]
-            for j in range(i + 1, n):
-                total -= a[i][j] * b[j]
-            b[i] = total / d[i]
+    def tolerance(self, m, n, diagonal):
+        #diagonal entries of R this small relative to the largest mean the
+        #columns of A are (numerically) linearly dependent; same cutoff as
+        #numpy.linalg.matrix_rank
+        largest = np.abs(diagonal).max(axis=-1)
+        return largest * max(m, n) * np.finfo(float).eps
 
-    #  Solves least squares problem: Give x which minimizes || A * x - b ||. In the process, the
-    #  matrix A is replaced with the QR decomposition of A, (the Hessenberg version). The solution
-    #  is deposited in the first n entries of b. It is assumed that A has at least as many rows and
-    #  columns.
+    #  Solves least squares problem: Give x which minimizes || A * x - b ||. 
+    #  The solution is deposited in the first n entries of b. It is assumed 
+    #  that A has at least as many rows as columns.
     # 
     #  param m: The number of equations
     #  param n: The number of unknowns
-    #  param a: The coefficient matrix
+    #  param a: The coefficient matrix (any m x n nested sequence or array)
     #  param b: The right-hand side
-    #  returns true if singular, false otherwise
+    #  returns true if singular (in which case b is unchanged), false otherwise
     def solve(self, m, n, a, b):
-        c = []
-        d = []
-        for i in range(n):
-            c.append(0.0)
-            d.append(0.0)
-        
-        if self.qrdcmp(m, n, a, c, d):
+        matrix = np.array(a, dtype=float)[:m, :n]
+        q, r = np.linalg.qr(matrix)
+        diagonal = np.diag(r)
+        if n == 0 or np.any(np.abs(diagonal) <= self.tolerance(m, n, diagonal)):
             return True
-        self.qrsolv(m, n, a, c, d, b)
+        x = np.linalg.solve(r, q.T.dot(np.array(b[:m], dtype=float)))
+        b[:n] = x.tolist()
         return False
+    
+    #  Solves many least squares problems of the same shape at once, by 
+    #  Householder QR applied to every system together.
+    #
+    #  param a: array of coefficient matrices, shape (systems, m, n)
+    #  param b: array of right-hand sides, shape (systems, m) or 
+    #           (systems, m, k) for k right-hand sides per system
+    #  returns (x, singular): the solutions, shape (systems, n) or 
+    #          (systems, n, k), and a boolean array saying which systems were
+    #          singular (their solutions are NaN)
+    def solve_batch(self, a, b):
+        a = np.array(a, dtype=float)
+        b = np.array(b, dtype=float)
+        vector = b.ndim == 2
+        if vector:
+            b = b[:, :, np.newaxis]
+        systems, m, n = a.shape
+        diagonal = np.zeros((systems, n))
+        
+        for j in range(n):
+            column = a[:, j:, j]
+            norm = np.sqrt((column ** 2).sum(axis=1))
+            #reflect column onto -sign(a_jj) * norm * e_j, which is R[j, j]
+            alpha = -np.where(column[:, 0] >= 0, norm, -norm)
+            v = column.copy()
+            v[:, 0] -= alpha
+            length = (v ** 2).sum(axis=1)
+            scale = np.where(length > 0, 2 / np.where(length > 0, length, 1), 0)
+            for block in (a[:, j:, j + 1:], b[:, j:, :]):
+                projection = np.einsum('sm,smk->sk', v, block)
+                block -= (scale[:, np.newaxis, np.newaxis] * v[:, :, np.newaxis] * 
+                          projection[:, np.newaxis, :])
+            diagonal[:, j] = alpha
+        
+        singular = np.any(np.abs(diagonal) <= 
+                          self.tolerance(m, n, diagonal)[:, np.newaxis], axis=1)
+        #back substitution, R * x = Q^T * b
+        x = np.zeros((systems, n, b.shape[2]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(n - 1, -1, -1):
+                rest = np.einsum('sj,sjk->sk', a[:, i, i + 1:], x[:, i + 1:, :])
+                x[:, i, :] = (b[:, i, :] - rest) / diagonal[:, i, np.newaxis]
+        x[singular] = np.nan
+        if vector:
+            x = x[:, :, 0]
+        return x, singular
 
 # vim: ts=4:sw=4:et
@@ -1,5 +1,192 @@
+import hashlib
+import json
+import os
+import sys
+import time
 
-library = {}
+class ComponentLibrary(dict):
+    """
+    The library of all known components, keyed by visible name.
+
+    Component modules are not imported until one of their components is
+    actually asked for; the manifest file records which module and class 
+    provide each visible name so that the library can list every component
+    without importing anything. The manifest is only read at runtime; it is
+    rebuilt as a build step with
+    
+        python -m cscience.components
+        
+    Any module whose source has changed since the manifest was built (or 
+    that it doesn't list) is imported the first time the library is asked 
+    about a component it can't place.
+    """
+
+    manifest_path = os.path.join(os.path.dirname(__file__), 'manifest.json')
+
+    def __init__(self):
+        super(ComponentLibrary, self).__init__()
+        #visible name -> (module name, class name)
+        self.locations = {}
+        #module name -> seconds spent importing it
+        self.import_times = {}
+        #module name -> error message, for modules that failed to import
+        self.failures = {}
+        #module name -> hash of its source, for modules whose components 
+        #are all in locations
+        self.scanned = {}
+        #modules the manifest doesn't know about (or knows an old version of)
+        self.pending = set()
+
+    def register(self, name, cls):
+        """
+        Called for every component class as it is created.
+        """
+        dict.__setitem__(self, name, cls)
+        self.locations[name] = (cls.__module__.rsplit('.', 1)[-1], cls.__name__)
+
+    def module_names(self):
+        path = os.path.dirname(__file__)
+        return sorted([filename[:-len('.py')] for filename in os.listdir(path)
+                       if filename.endswith('.py') and 
+                          not filename.startswith('_')])
+        
+    def module_stamp(self, module):
+        """
+        Returns a hash of the source of a component module, so the manifest
+        can tell when the module has changed.
+        """
+        path = os.path.join(os.path.dirname(__file__), module + '.py')
+        with open(path, 'rb') as source:
+            return hashlib.sha1(source.read()).hexdigest()
+
+    def load_manifest(self):
+        """
+        Reads the component locations from the manifest, if there is one.
+        Entries for modules that have changed since the manifest was built
+        are ignored, and those modules are rescanned along with any the 
+        manifest doesn't list.
+        """
+        try:
+            with open(self.manifest_path, 'rb') as manifest:
+                contents = json.load(manifest)
+            stamps = dict(contents['modules'])
+        except (IOError, ValueError, KeyError, TypeError):
+            contents = {'components':{}}
+            stamps = {}
+        current = dict([(module, self.module_stamp(module)) for 
+                        module in self.module_names()])
+        self.pending = set([module for module, stamp in current.iteritems()
+                            if stamps.get(module) != stamp])
+        self.scanned.update([(module, stamp) for module, stamp in 
+                             current.iteritems() if module not in self.pending])
+        for name, location in contents['components'].iteritems():
+            if location[0] in self.scanned:
+                self.locations.setdefault(name, tuple(location))
+        
+    def scan_pending(self):
+        if self.pending:
+            modules, self.pending = self.pending, set()
+            self.scan(modules)
+
+    def save_manifest(self, path=None):
+        """
+        Writes the component locations found so far to the manifest at path
+        (by default, the one the library reads).
+        """
+        with open(path or self.manifest_path, 'wb') as manifest:
+            json.dump({'modules':self.scanned,
+                       'components':self.locations},
+                      manifest, indent=2, sort_keys=True, 
+                      separators=(',', ': '))
+
+    def scan(self, modules=None):
+        """
+        Imports the given component modules (or all of them) so that their
+        components register themselves.
+        """
+        for module in modules or self.module_names():
+            try:
+                self.load_module(module)
+            except ImportError as exc:
+                print exc
+            else:
+                self.scanned[module] = self.module_stamp(module)
+
+    def build_manifest(self, path=None):
+        """
+        Re-creates the manifest from scratch by importing every component
+        module and recording what the component metaclass registered. 
+        Returns the path written.
+        """
+        self.locations = dict([(name, loc) for name, loc in
+                               self.locations.iteritems() if name in self])
+        self.scanned = {}
+        self.pending = set()
+        self.scan()
+        path = path or self.manifest_path
+        self.save_manifest(path)
+        return path
+
+    def load_module(self, module):
+        fullname = '.'.join((__name__, module))
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        if module in self.failures:
+            raise ImportError(self.failures[module])
+        start = time.time()
+        try:
+            __import__(fullname)
+        except Exception as exc:
+            self.failures[module] = 'problem importing component module %s: %r' % \
+                                    (module, exc)
+            raise ImportError(self.failures[module])
+        finally:
+            self.import_times[module] = time.time() - start
+        return sys.modules[fullname]
+
+    def __missing__(self, name):
+        if name not in self.locations:
+            self.scan_pending()
+        try:
+            module, classname = self.locations[name]
+        except KeyError:
+            raise KeyError(name)
+        self.load_module(module)
+        try:
+            return dict.__getitem__(self, name)
+        except KeyError:
+            #stale manifest entry; the module no longer provides this.
+            del self.locations[name]
+            raise KeyError(name)
+
+    def import_time(self, name):
+        """
+        Returns the time spent importing the module that provides component
+        name, or None if that module has not been imported.
+        """
+        try:
+            return self.import_times.get(self.locations[name][0])
+        except KeyError:
+            return None
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except (KeyError, ImportError):
+            return default
+    def keys(self):
+        self.scan_pending()
+        return sorted(set(self.locations) | set(dict.keys(self)))
+    def __iter__(self):
+        return iter(self.keys())
+    def __contains__(self, name):
+        if name not in self.locations:
+            self.scan_pending()
+        return name in self.locations or dict.__contains__(self, name)
+    def __len__(self):
+        return len(self.keys())
+
+library = ComponentLibrary()
 
 class _ComponentType(type):
     """
@@ -10,13 +197,23 @@ class _ComponentType(type):
         lib_entry = dct.pop('visible_name', None)
         newclass = super(_ComponentType, cls).__new__(cls, name, bases, dct)
         if lib_entry:
-            library[lib_entry] = newclass
+            library.register(lib_entry, newclass)
         return newclass
 
 class BaseComponent(object):
     """Base class for workflow components."""
     
     __metaclass__ = _ComponentType
+    
+    inputs = {'required':(), 'optional':()}
+    outputs = ()
+    #Number of neighboring samples (by depth, on each side) whose inputs can
+    #change this component's result for a sample. A negative value means the
+    #result for any sample depends on the whole core.
+    neighborhood = 0
+    #Components that implement run_ensemble should set this, so that
+    #workflows made up of them can be run as ensembles.
+    ensemble_capable = False
 
     def __init__(self):
         self.connections = dict.fromkeys(self.output_ports())
@@ -43,6 +240,17 @@ class BaseComponent(object):
         about input/output specifics."""
         raise NotImplementedError("Components run_component method "
                                   "or override __call__ method")
+        
+    def run_ensemble(self, columns):
+        """Batch version of run_component used for ensemble runs. columns 
+        maps attribute names to arrays with one row per sample and one column
+        per realization (some inputs may have a single column, to be 
+        broadcast against the rest); returns a dictionary of output attribute
+        name -> array with a row per sample and a column per realization.
+        Components that support this must also set ensemble_capable.
+        """
+        raise NotImplementedError("Component %s does not support ensemble "
+                                  "runs" % type(self).__name__)
 
     def connect(self, component, name='output'):
         self.connections[name] = component.input_port()
@@ -56,6 +264,5 @@ class BaseComponent(object):
     @classmethod
     def output_ports(cls):
         return ('output',)
-    
-        
-        
+
+library.load_manifest()
@@ -0,0 +1,14 @@
+"""
+Rebuilds the component manifest (see ComponentLibrary). Run as
+
+    python -m cscience.components [manifest path]
+    
+from the source directory whenever component modules are added or changed,
+and before making a release.
+"""
+
+import sys
+
+from cscience.components import library
+
+print 'wrote component manifest to', library.build_manifest(*sys.argv[1:2])
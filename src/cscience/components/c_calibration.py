@@ -1,4 +1,5 @@
-import itertools
+import warnings
+import numpy as np
 
 import cscience.components
 from cscience.components import datastructures
@@ -11,53 +12,192 @@ class SimpleIntCalCalibrator(cscience.components.BaseComponent):
     outputs = ('Calibrated 14C Age', 'Calibrated 14C Age Error-', 
                'Calibrated 14C Age Error+')
     params = {'calibration curve':('14C Age', 'Calibrated Age', 'Error')}
+    ensemble_capable = True
+    
+    def load_curve(self):
+        """
+        Gets the curve indexed by 14C age, along with the smallest and largest
+        calibrated ages and the largest error recorded for each 14C age on it.
+        """
+        curve = self.paleobase[self.computation_plan['calibration curve']]
+        self.curve = datastructures.index_cache.get(curve, '14C Age', 
+                            datastructures.RangeIndex.from_collection)
+        self.mincal = self.curve.reduce('Calibrated Age', np.minimum)
+        self.maxcal = self.curve.reduce('Calibrated Age', np.maximum)
+        self.maxerr = self.curve.reduce('Error', np.maximum)
     
     def run_component(self, samples):
-        self.curve = datastructures.collection_to_bintree(
-                    self.paleobase[self.computation_plan['calibration curve']], 
-                    '14C Age')
+        self.load_curve()
+        samples = [sample for sample in samples if sample['14C Age'] is not None]
+        count = len(samples)
+        ages = np.array([sample['14C Age'] for sample in samples], dtype=float)
+        errors = np.array([sample['14C Age Error'] or 0 for sample in samples],
+                          dtype=float)
+        #all three lookups per sample go through one search
+        calibrated, baseerr = self.calibrate(
+                            np.concatenate((ages, ages - errors, ages + errors)))
+        age = calibrated[:count]
+        minage = calibrated[count:2 * count]
+        maxage = calibrated[2 * count:]
+        #with no 14C error, minage and maxage are just age again
+        lower = baseerr[:count] + (age - minage)
+        upper = baseerr[:count] + (maxage - age)
         
-        for sample in samples:
-            age, baseerr = self.convert_age(sample['14C Age'])
-            sample['Calibrated 14C Age'] = age
-            sample['Calibrated 14C Age Error-'] = baseerr 
-            sample['Calibrated 14C Age Error+'] = baseerr
-            if sample['14C Age Error']:
-                minage = self.convert_age(sample['14C Age'] - sample['14C Age Error'])[0]
-                sample['Calibrated 14C Age Error-'] += (age - minage)
-                maxage = self.convert_age(sample['14C Age'] + sample['14C Age Error'])[0]
-                sample['Calibrated 14C Age Error+'] += (maxage - age)
+        for index, sample in enumerate(samples):
+            sample['Calibrated 14C Age'] = float(age[index])
+            sample['Calibrated 14C Age Error-'] = float(lower[index])
+            sample['Calibrated 14C Age Error+'] = float(upper[index])
             
-    def convert_age(self, age):
+    def run_ensemble(self, columns):
+        #each realization already carries the measurement error, so only the
+        #calibrated age itself is drawn; as for a plain run, the errors are 
+        #the curve error plus the spread of the calibrated ages (here, out to
+        #the 16th/84th percentiles of the realizations)
+        self.load_curve()
+        ages, baseerr = self.calibrate(columns['14C Age'])
+        with warnings.catch_warnings():
+            #all-NaN rows are expected for samples missing their inputs
+            warnings.simplefilter('ignore', RuntimeWarning)
+            low, median, high = np.nanpercentile(ages, (16, 50, 84), axis=1, 
+                                                 keepdims=True)
+            baseerr = np.nanmedian(baseerr, axis=1, keepdims=True)
+        return {'Calibrated 14C Age':ages,
+                'Calibrated 14C Age Error-':baseerr + (median - low),
+                'Calibrated 14C Age Error+':baseerr + (high - median)}
+    
+    def calibrate(self, ages):
         """
-        returns a "base" calibrated age and an error +/- 
+        Takes an array of 14C ages and returns arrays (of the same shape) of
+        "base" calibrated ages and their +/- errors. NaN ages give NaN.
         """
-        #for this age value, what I want are:
-        #min cal age, max cal age, max error
-        data = self.curve.get_range_nodes(age)
-        #56000 is the approx max dating range of c14
-        maxerr = 0
-        if not data[0]:
-            #guess
-            minage = age - 10000
-            d0 = []
-        else:
-            minage = 56000
-            d0 = data[0].data
-        if not data[1]:
-            #guess
-            maxage = age + 10000
-            d1 = []
-        else:
-            maxage = 0
-            d1 = data[1].data
+        ages = np.asarray(ages, dtype=float)
+        flat = ages.ravel()
+        #for each age, what I want are the curve entries at or just either
+        #side of it; from those: min cal age, max cal age, max error
+        lower, upper = self.curve.bracket(flat)
+        has_lower = lower >= 0
+        has_upper = upper < len(self.curve)
+        lower = np.maximum(lower, 0)
+        upper = np.minimum(upper, len(self.curve) - 1)
+        
+        #56000 is the approx max dating range of c14; with nothing on one
+        #side of the age, guess.
+        minage = np.where(has_lower, 56000, flat - 10000)
+        maxage = np.where(has_upper, 0, flat + 10000)
+        maxerr = np.zeros(len(flat))
+        for present, rows in ((has_lower, lower), (has_upper, upper)):
+            minage = np.where(present, np.minimum(minage, self.mincal[rows]), minage)
+            maxage = np.where(present, np.maximum(maxage, self.maxcal[rows]), maxage)
+            maxerr = np.where(present, np.maximum(maxerr, self.maxerr[rows]), maxerr)
         
         #TODO: this is a mathematical hack because probability is hard.
-        for entry in itertools.chain(d0, d1):
-            minage = min(minage, entry['Calibrated Age'])
-            maxage = max(maxage, entry['Calibrated Age'])
-            maxerr = max(maxerr, entry['Error'])
         diff = (maxage - minage) / 2
-        maxerr += diff
-        return (minage + diff, maxerr)
+        missing = np.isnan(flat)
+        age = np.where(missing, np.nan, minage + diff)
+        error = np.where(missing, np.nan, maxerr + diff)
+        return age.reshape(ages.shape), error.reshape(ages.shape)
+            
+    def convert_age(self, age):
+        """
+        returns a "base" calibrated age and an error +/- 
+        """
+        calibrated, error = self.calibrate([age])
+        return (float(calibrated[0]), float(error[0]))
+
 
+class ProbabilisticIntCalCalibrator(cscience.components.BaseComponent):
+    """
+    Calibrates 14C ages by computing, for each sample, the probability 
+    density over calendar age given Gaussian errors on both the measurement
+    and the calibration curve. Densities are evaluated on a regular calendar
+    grid for a whole chunk of samples at once.
+    
+    Highest-density ranges can be made up of several disjoint pieces; the
+    reported range runs from the lowest to the highest of them.
+    """
+    visible_name = 'Probabilistic Carbon 14 Calibration (IntCal)'
+    inputs = {'required':('14C Age',), 'optional':('14C Age Error',)}
+    outputs = ('Calibrated 14C Age', 'Calibrated 14C Age Error-', 
+               'Calibrated 14C Age Error+', 'Calibrated Age Median', 
+               'Calibrated Age Mode', 'Calibrated Age 68% Low', 
+               'Calibrated Age 68% High', 'Calibrated Age 95% Low', 
+               'Calibrated Age 95% High')
+    params = {'calibration curve':('14C Age', 'Calibrated Age', 'Error')}
+    
+    #calendar years between grid points, and the most samples whose densities
+    #are held in memory at once
+    resolution = 5
+    chunk_size = 500
+    #measurements further than this many sigma from every point on the curve
+    #are out of its range, and get no calibrated age
+    max_sigma = 5
+    
+    def load_curve(self):
+        curve = self.paleobase[self.computation_plan['calibration curve']]
+        index = datastructures.index_cache.get(curve, 'Calibrated Age',
+                            datastructures.RangeIndex.from_collection)
+        calendar = index.row_keys
+        self.grid = np.arange(calendar[0], calendar[-1] + self.resolution, 
+                              self.resolution)
+        self.mu = np.interp(self.grid, calendar, index.column('14C Age'))
+        self.sigma = np.interp(self.grid, calendar, index.column('Error'))
+    
+    def run_component(self, samples):
+        self.load_curve()
+        samples = [sample for sample in samples if sample['14C Age'] is not None]
+        for start in range(0, len(samples), self.chunk_size):
+            chunk = samples[start:start + self.chunk_size]
+            ages = np.array([sample['14C Age'] for sample in chunk], dtype=float)
+            errors = np.array([sample['14C Age Error'] or 0 for sample in chunk],
+                              dtype=float)
+            results = self.summarize(*self.densities(ages, errors))
+            for index, sample in enumerate(chunk):
+                for att, values in results.iteritems():
+                    value = values[index]
+                    sample[att] = None if np.isnan(value) else float(value)
+                    
+    def densities(self, ages, errors):
+        """
+        Returns an array of normalized densities, one row per sample and one
+        column per calendar grid point, along with a mask of which samples 
+        fall within the range of the curve.
+        """
+        variance = errors[:, np.newaxis] ** 2 + self.sigma ** 2
+        zsquared = (ages[:, np.newaxis] - self.mu) ** 2 / variance
+        #work in logs so that far-off grid points underflow harmlessly
+        logdensity = -0.5 * zsquared - 0.5 * np.log(variance)
+        logdensity -= logdensity.max(axis=1)[:, np.newaxis]
+        density = np.exp(logdensity)
+        density /= density.sum(axis=1)[:, np.newaxis]
+        return density, zsquared.min(axis=1) <= self.max_sigma ** 2
+    
+    def summarize(self, density, valid):
+        """
+        Reduces each row of density to its median, mode and 68% and 95% 
+        highest-density ranges; returns a dictionary of output attribute ->
+        array of values, NaN where valid is False.
+        """
+        grid = self.grid
+        cumulative = np.cumsum(density, axis=1)
+        median = grid[np.minimum((cumulative < 0.5).sum(axis=1), len(grid) - 1)]
+        results = {'Calibrated Age Median':median,
+                   'Calibrated Age Mode':grid[density.argmax(axis=1)]}
+        
+        ranked = -np.sort(-density, axis=1)
+        ranked_total = np.cumsum(ranked, axis=1)
+        rows = np.arange(len(density))
+        for level in (68, 95):
+            #the smallest set of grid points holding level% of the probability
+            cutoff = np.minimum((ranked_total < level / 100.0).sum(axis=1), 
+                                len(grid) - 1)
+            inside = density >= ranked[rows, cutoff][:, np.newaxis]
+            results['Calibrated Age %d%% Low' % level] = grid[inside.argmax(axis=1)]
+            results['Calibrated Age %d%% High' % level] = \
+                        grid[len(grid) - 1 - inside[:, ::-1].argmax(axis=1)]
+            
+        results['Calibrated 14C Age'] = median
+        results['Calibrated 14C Age Error-'] = median - results['Calibrated Age 68% Low']
+        results['Calibrated 14C Age Error+'] = results['Calibrated Age 68% High'] - median
+        for att in results:
+            results[att] = np.where(valid, results[att], np.nan)
+        return results
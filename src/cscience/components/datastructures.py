@@ -27,68 +27,155 @@ datastructures.py
 * SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import itertools
+import collections
+import threading
 
-class StaticBinTree(object):
-    def __init__(self, left, key, data, right):
-        self.left = left
-        self.key = key
-        self.data = data
-        self.right = right
-    
-    def get_range_nodes(self, key, currange=(None, None)):
-        #NOTE: this function assumes the keys in the tree are UNIQUE!
-        if key == self.key:
-            return (self, self)
-        elif key < self.key:
-            newrange = (currange[0], self)
-            #if currange[1]:
-            #    print "doing left:", currange[1].key, self.key
-            if self.left and (not currange[1] or currange[1].key > self.key):
-                return self.left.get_range_nodes(key, newrange)
-            else:
-                return newrange
-        else:
-            #key > self.key
-            newrange = (self, currange[1])
-            #if currange[0]:
-            #    print "doing right:", currange[0].key, self.key
-            if self.right and (not currange[0] or currange[0].key < self.key):
-                return self.right.get_range_nodes(key, newrange)
-            else:
-                return newrange
-    
+import numpy as np
 
-def collection_to_bintree(coll, keyname):
+class RangeIndex(object):
     """
-    Takes a dictionary of dictionaries and the name of a sub-dictionary entry
-    that is sortable (typically numeric, but feel free to
-    use strings if that's somehow useful) and returns a static (cannot be 
-    modified) balanced binary tree containing lists of the input sub-dictionaries
-    and sorted by the values under the passed key name. The 
-    advantage to this binary tree is that you can get a range of data instead 
-    of just a single value cheaply (which is quite inconvenient from the 
-    original dictionary). Note that the dictionary's original keys are discarded.
-    """ 
-    #assumes the milieu of interest is keyless
-    vals = coll.values()
-    vals.sort(key=lambda x: x[keyname])
-    #force realization of iterators or they don't work properly, thannnnnks
-    #itertools
-    keyset = [(it[0], list(it[1])) for it in 
-              itertools.groupby(vals, key=lambda x: x[keyname])]
+    A static (cannot be modified) index over a collection of rows (dicts), 
+    sorted by the values under one key name, that answers range-style 
+    queries for many values at once. Rows sharing a key value form a group;
+    groups are numbered in key order, and keys[i] is the key of group i.
     
-    def make_tree(keyset):
-        #take a sorted list of keys and turn it into a sub-tree
-        if not keyset:
-            return None
-        keylen = len(keyset)
-        mid = len(keyset) / 2 # int rounding makes our tree slightly biased, oh well.
-        return StaticBinTree(make_tree(keyset[:mid]), keyset[mid][0], 
-                             list(keyset[mid][1]), make_tree(keyset[mid+1:]))
+    Build one from a milieu with RangeIndex.from_collection, which takes the
+    same arguments as the builders used with IndexCache.
+    """
+    
+    def __init__(self, rows, keyname):
+        self.keyname = keyname
+        self.rows = sorted(rows, key=lambda row: row[keyname])
+        self.row_keys = np.array([row[keyname] for row in self.rows], dtype=float)
+        self.keys, self.starts = np.unique(self.row_keys, return_index=True)
+        self.ends = np.append(self.starts[1:], len(self.rows))
+        self._columns = {}
+        self._reduced = {}
         
-    return make_tree(keyset)
-
+    @classmethod
+    def from_collection(cls, coll, keyname):
+        """
+        Indexes the values (rows) of a dictionary of dictionaries, such as a
+        keyless milieu; the dictionary's own keys are discarded.
+        """
+        return cls(coll.values(), keyname)
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    def column(self, name):
+        """
+        Returns the values under name for every row, in key order, as an array.
+        """
+        try:
+            return self._columns[name]
+        except KeyError:
+            values = np.array([row[name] for row in self.rows], dtype=float)
+            self._columns[name] = values
+            return values
+        
+    def reduce(self, name, ufunc):
+        """
+        Returns an array with one value per group: the values under name for
+        the rows in that group combined with ufunc (e.g. np.maximum).
+        """
+        try:
+            return self._reduced[(name, ufunc)]
+        except KeyError:
+            values = ufunc.reduceat(self.column(name), self.starts)
+            self._reduced[(name, ufunc)] = values
+            return values
+    
+    def bracket(self, values):
+        """
+        For each of values, finds the groups with the nearest keys at or below
+        and at or above it (both are the same group on an exact match). 
+        Returns two arrays of group numbers, (lower, upper); where there is no
+        such group lower is -1 and upper is len(self).
+        """
+        values = np.asarray(values, dtype=float)
+        upper = np.searchsorted(self.keys, values)
+        exact = (upper < len(self.keys)) & \
+                (self.keys[np.minimum(upper, len(self.keys) - 1)] == values)
+        lower = np.where(exact, upper, upper - 1)
+        return lower, upper
+    
+    def overlapping(self, low, high):
+        """
+        For each interval [low, high] (both arrays), returns the range of 
+        rows with keys inside it, as two arrays (first, last) such that rows
+        first through last - 1 match.
+        """
+        return (np.searchsorted(self.row_keys, np.asarray(low, dtype=float), 'left'),
+                np.searchsorted(self.row_keys, np.asarray(high, dtype=float), 'right'))
+    
+    def nearest(self, values, k=1):
+        """
+        Returns an array with a row for each of values, holding the group 
+        numbers of the k groups whose keys are closest to it, closest first.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        k = min(k, len(self.keys))
+        #the k nearest are all within k places of where the value would go
+        candidates = np.searchsorted(self.keys, values)[:, np.newaxis] + \
+                     np.arange(-k, k)
+        valid = (candidates >= 0) & (candidates < len(self.keys))
+        candidates = np.clip(candidates, 0, len(self.keys) - 1)
+        distance = np.where(valid, np.abs(self.keys[candidates] - 
+                                          values[:, np.newaxis]), np.inf)
+        order = np.argsort(distance, axis=1, kind='mergesort')[:, :k]
+        return candidates[np.arange(len(values))[:, np.newaxis], order]
 
 
+class IndexCache(object):
+    """
+    A size-bounded cache of lookup structures built over milieu columns, 
+    shared by every component in the process so that (for instance) a 
+    calibration curve is indexed once rather than on every component run.
+    
+    Entries are keyed by milieu name, key column and the function used to
+    build them, and are rebuilt whenever the milieu's version changes. The
+    least recently used entries are dropped once there are more than maxsize.
+    """
+    
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        #workflows run on worker threads
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, milieu, keyname, build):
+        """
+        Returns build(milieu, keyname), reusing the cached result if the 
+        milieu hasn't changed since it was built.
+        """
+        key = (milieu.name, keyname, build)
+        version = getattr(milieu, 'version', None)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] == version:
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        #building can be slow; don't hold everyone else up meanwhile
+        index = build(milieu, keyname)
+        with self.lock:
+            self.entries[key] = (version, index)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return index
+    
+    def invalidate(self, name=None):
+        """
+        Drops all cached entries for the milieu called name (or for every
+        milieu if no name is given).
+        """
+        with self.lock:
+            for key in self.entries.keys():
+                if name is None or key[0] == name:
+                    del self.entries[key]
 
+index_cache = IndexCache()
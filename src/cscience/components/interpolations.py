@@ -1,13 +1,135 @@
+import collections
+import threading
+
+import numpy as np
+from scipy import interpolate
+
 import cscience.components
-from scipy.interpolate import griddata
-       
 
-class Cubic(cscience.components.BaseComponent):
-    visible_name = 'Cubic Interpolation (Coming Soon)'
+#fitted age-depth models, keyed by the interpolation used and the exact data
+#it was fitted to, so the same model is never fitted twice
+_models = collections.OrderedDict()
+_models_lock = threading.Lock()
+MAX_MODELS = 32
+
+def merge_depths(depths, ages, errors):
+    """
+    Combines dated samples that share a depth (depths must be sorted), as
+    the models need strictly increasing depths. Ages at a depth are averaged
+    weighted by 1/error**2, giving an error of 1/sqrt(sum of weights); if 
+    any of them has no error, they are averaged evenly and the merged error
+    is unknown (0) as well.
+    """
+    depths, index, counts = np.unique(depths, return_inverse=True, 
+                                      return_counts=True)
+    if len(depths) == len(ages):
+        return depths, ages, errors
+    unknown = np.bincount(index, errors <= 0) > 0
+    weights = 1 / np.where(errors > 0, errors, 1) ** 2
+    weights[unknown[index]] = 1
+    total = np.bincount(index, weights)
+    ages = np.bincount(index, weights * ages) / total
+    errors = np.where(unknown, 0, 1 / np.sqrt(total))
+    return depths, ages, errors
+
+class AgeDepthInterpolation(cscience.components.BaseComponent):
+    """
+    Base for components that fit an age-depth model to the dated samples in
+    a core and use it to give every sample in the core a model age. 
+    Subclasses provide fit, which returns a callable mapping an array of 
+    depths to an array of ages.
+    """
+    inputs = {'required':('depth', 'Calibrated 14C Age'), 
+              'optional':('Calibrated 14C Age Error-', 
+                          'Calibrated 14C Age Error+')}
+    outputs = ('Model Age',)
+    #every sample's model age depends on all the dated samples
+    neighborhood = -1
+    #fewest dated samples the model can be fitted to
+    min_points = 2
     
     def run_component(self, samples):
-        samples['interpolation curve'] = None
-        #grid_z0 = griddata(points, values, (grid_x, grid_y), method='nearest')
-        #grid_z1 = griddata(points, values, (grid_x, grid_y), method='linear')
-        #grid_z2 = griddata(points, values, (grid_x, grid_y), method='cubic')
+        samples = list(samples)
+        model = self.model(samples)
+        if model is None:
+            for sample in samples:
+                sample['Model Age'] = None
+            return
+        depths = np.array([sample['depth'] for sample in samples], dtype=float)
+        for sample, age in zip(samples, model(depths)):
+            sample['Model Age'] = None if np.isnan(age) else float(age)
+            
+    def model(self, samples):
+        """
+        Returns the age-depth model for samples (re-using an already fitted
+        one when possible), or None if there aren't enough dated samples to
+        fit one. The model can be called with any array of depths.
+        """
+        dated = [sample for sample in samples if 
+                 sample['Calibrated 14C Age'] is not None]
+        if len(dated) < self.min_points:
+            return None
+        depths = np.array([sample['depth'] for sample in dated], dtype=float)
+        ages = np.array([sample['Calibrated 14C Age'] for sample in dated], 
+                        dtype=float)
+        errors = np.array([((sample['Calibrated 14C Age Error-'] or 0) + 
+                            (sample['Calibrated 14C Age Error+'] or 0)) / 2.0
+                           for sample in dated], dtype=float)
+        order = np.argsort(depths)
+        depths, ages, errors = merge_depths(depths[order], ages[order], 
+                                            errors[order])
+        if len(depths) < self.min_points:
+            return None
+        
+        key = (type(self), depths.tostring(), ages.tostring(), errors.tostring())
+        with _models_lock:
+            model = _models.pop(key, None)
+            if model is not None:
+                _models[key] = model
+                return model
+        model = self.fit(depths, ages, errors)
+        with _models_lock:
+            _models[key] = model
+            while len(_models) > MAX_MODELS:
+                _models.popitem(last=False)
+        return model
+    
+    def fit(self, depths, ages, errors):
+        raise NotImplementedError("Interpolations must implement fit")
+    
 
+class LinearInterpolation(AgeDepthInterpolation):
+    visible_name = 'Linear Age-Depth Interpolation'
+    
+    def fit(self, depths, ages, errors):
+        #straight lines between dated samples, extended past either end
+        return interpolate.interp1d(depths, ages, assume_sorted=True,
+                                    fill_value='extrapolate')
+    
+class MonotoneCubicInterpolation(AgeDepthInterpolation):
+    """
+    Piecewise cubic (PCHIP) interpolation, which never overshoots the dated
+    samples, so ages stay in order wherever the dates themselves are.
+    """
+    visible_name = 'Monotone Cubic Age-Depth Interpolation'
+    
+    def fit(self, depths, ages, errors):
+        return interpolate.PchipInterpolator(depths, ages)
+    
+class SmoothingSplineInterpolation(AgeDepthInterpolation):
+    """
+    Cubic smoothing spline, weighted by the calibrated age errors, so that 
+    the model need not pass exactly through every (uncertain) date.
+    """
+    visible_name = 'Smoothing Spline Age-Depth Interpolation'
+    min_points = 4
+    #smoothing factor passed to scipy; None lets scipy pick one suited to
+    #weights of 1/error
+    smoothing = None
+    
+    def fit(self, depths, ages, errors):
+        weights = None
+        if np.all(errors > 0):
+            weights = 1 / errors
+        return interpolate.UnivariateSpline(depths, ages, w=weights, k=3, 
+                                            s=self.smoothing)
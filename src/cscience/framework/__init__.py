@@ -71,11 +71,15 @@ class Collection(dict):
         
 from calculations import ComputationPlan, ComputationPlans, Workflow, \
     Workflows, Selector, Selectors
+from profiling import ComponentRun, ExecutionProfile
+from checkpoints import Checkpoint
 from paleobase import Milieu, Milieus, Template, Templates
 from samples import Attribute, Attributes, Core, VirtualCore, Cores, Sample, VirtualSample
+from ensemble import Ensemble
 from views import Filter, FilterFilter, FilterItem, Filters, View, Views
 
 __all__ = ('Attribute', 'Attributes', 'Milieu', 'Milieus', 'ComputationPlan', 'ComputationPlans', 
            'Selector', 'Selectors', 'Filter', 'FilterFilter', 'FilterItem', 
            'Filters', 'Core', 'Cores', 'Sample', 'Template', 'Templates', 
-           'View', 'Views', 'VirtualSample', 'Workflow', 'Workflows')
+           'View', 'Views', 'VirtualSample', 'Workflow', 'Workflows',
+           'ComponentRun', 'ExecutionProfile', 'Checkpoint', 'Ensemble')
@@ -34,6 +34,7 @@ import re
 import cscience.components
 import cscience.datastore
 from cscience.framework import Collection
+from cscience.framework.samples import Attribute
 
 
 factor_exp = re.compile('<(.*?)>')
@@ -83,6 +84,82 @@ class Workflow(object):
                                   'params', {}).keys())
         return params
 
+    def component_classes(self, experiment):
+        """
+        Returns the classes of all components this workflow will run for the
+        given experiment (with factors resolved to their selected components)
+        """
+        classes = []
+        for name in self.connections:
+            if name.startswith('Factor'):
+                selector = cscience.datastore.selectors[extract_factor(name)]
+                names = selector[experiment[selector.name]]
+            else:
+                names = [name]
+            classes.extend([cscience.components.library[cname] 
+                            for cname in names])
+        return classes
+    
+    def find_inputs(self, experiment):
+        """
+        Returns the set of all sample attributes read by this workflow.
+        """
+        inputs = set()
+        for component in self.component_classes(experiment):
+            for atts in component.inputs.itervalues():
+                inputs.update(atts)
+        return inputs
+    
+    def find_outputs(self, experiment):
+        """
+        Returns the set of output attributes (those kept once the workflow is
+        done) written by this workflow.
+        """
+        outputs = set()
+        for component in self.component_classes(experiment):
+            outputs.update([att for att in component.outputs if 
+                            att in cscience.datastore.sample_attributes and
+                            cscience.datastore.sample_attributes[att].output])
+        return outputs
+    
+    def register_outputs(self, experiment):
+        """
+        Makes sure every attribute declared as an output by this workflow's
+        components exists, adding any that don't as (float) output 
+        attributes; ones already present are left as they are. Returns the 
+        names of any attributes added.
+        """
+        added = []
+        for component in self.component_classes(experiment):
+            for att in component.outputs:
+                if att not in cscience.datastore.sample_attributes:
+                    cscience.datastore.sample_attributes.add(
+                                            Attribute(att, 'float', True))
+                    added.append(att)
+        return added
+    
+    def find_neighborhood(self, experiment):
+        """
+        Returns how many neighboring samples can affect the result for a
+        sample, across all components in this workflow (negative means all
+        samples in a core).
+        """
+        sizes = [component.neighborhood for component in 
+                 self.component_classes(experiment)]
+        if any([size < 0 for size in sizes]):
+            return -1
+        return max(sizes or [0])
+    
+    def changed_depths(self, experiment, core, mode=None):
+        """
+        Returns the depths in core that must be recomputed to bring the
+        results of experiment up to date with the core's input data, for a 
+        run in the given mode (None for a plain run, or Ensemble.mode).
+        """
+        return core.changed_depths(experiment.name, 
+                                   self.find_inputs(experiment), 
+                                   self.find_neighborhood(experiment), mode)
+
     def load_component(self, name, experiment):
         if name.startswith('Factor'):
             component = cscience.datastore.selectors[extract_factor(name)]
@@ -110,9 +187,43 @@ class Workflow(object):
                 components[component_name].connect(components[target_name], port)
         return components
         
-    def execute(self, cplan, core, aborting):
+    def checkpoint_stamp(self, cplan, core):
+        """
+        Identifies a run of this workflow closely enough that a checkpoint 
+        saved for it is only reused for exactly the same plan and input data.
+        """
+        atts = sorted(self.find_inputs(cplan))
+        return (self.name, sorted(self.connections.items()), sorted(cplan.items()),
+                [(depth, core.input_stamp(depth, atts)) 
+                 for depth in sorted(core.keys())])
+        
+    def execute(self, cplan, core, aborting, profile=None, checkpoint=None):
+        """
+        Runs this workflow over core using the computation plan cplan.
+        aborting should be a callable that returns True if the run should stop
+        early; returns False if the run was aborted, True otherwise.
+        
+        If an ExecutionProfile is passed as profile, every component 
+        invocation is recorded in it.
+        If a Checkpoint is passed as checkpoint, the run resumes from it (when
+        it was saved for this same run) and saves progress to it as it goes;
+        the checkpoint is removed once the run completes.
+        """
+        self.register_outputs(cplan)
         components = self.instantiate(cplan)
-        first_component = components[self.find_first_component()]
+        if profile is not None:
+            for name in components:
+                profile.imports[name] = \
+                        cscience.components.library.import_time(name)
+        first_component = components[self.find_first_component()].input_port()
+        names = dict([(id(component.input_port()), name) for 
+                      name, component in components.iteritems()])
+        
+        def invoke(component, core):
+            if profile is None:
+                return component(core)
+            name = names.get(id(component), type(component).__name__)
+            return profile.run(name, component, core)
 
         # bad ass pythonic execution algorithm written by Evan Sheehan
         # gist: 
@@ -131,18 +242,146 @@ class Workflow(object):
         #             than zero samples to process and 2) is not already in
         #             the queue. This ensures that the queue eventually
         #             empties out.
-        q = collections.deque([([first_component], core)])
+        q = collections.deque([(first_component, core)])
+        
+        if checkpoint is not None:
+            stamp = self.checkpoint_stamp(cplan, core)
+            state = checkpoint.load(stamp)
+            if state is not None:
+                core.restore_results(state['results'])
+                q = collections.deque([
+                        (components[name].input_port(), core.subset(depths))
+                        for name, depths in state['queue']])
+            
+            def get_state():
+                queued = []
+                for component, samples in q:
+                    if id(component) not in names:
+                        #partway through a Selector; wait for a clean break
+                        return None
+                    queued.append((names[id(component)], 
+                                   [sample['depth'] for sample in samples]))
+                return {'stamp':stamp, 'queue':queued, 
+                        'results':core.results()}
+        
         while q:
             if aborting():
                 return False
-            components, core = q.popleft()
-            for pending in map(lambda comp: comp(core), components):
-                for pair in pending:
-                    if pair[0] and pair[1] and pending not in q:
-                        q.append(pair)
+            component, samples = q.popleft()
+            for pair in invoke(component, samples):
+                if pair[0] and pair[1] and pair not in q:
+                    q.append(pair)
+            if aborting():
+                #results may be getting thrown away; don't save them
+                return False
+            if checkpoint is not None:
+                checkpoint.step(get_state)
                         
         for sample in core:
             sample.remove_exp_intermediates()
+        core.record_inputs(self.find_inputs(cplan))
+        if checkpoint is not None:
+            checkpoint.clear()
+        return True
+
+    def ensemble_chain(self, components):
+        """
+        Returns the components of an instantiated workflow in the order they
+        run, as (name, component) pairs, for an ensemble run. Raises a 
+        ValueError if the workflow can't be run as an ensemble: every 
+        component must be ensemble capable, and samples must flow straight 
+        through without being split between ports.
+        """
+        names = dict([(id(component.input_port()), name) for 
+                      name, component in components.iteritems()])
+        chain = []
+        component = components[self.find_first_component()].input_port()
+        while component is not None:
+            name = names.get(id(component), type(component).__name__)
+            if not component.ensemble_capable:
+                raise ValueError("Component '%s' cannot be run as part of an "
+                                 "ensemble" % name)
+            targets = [target for target in component.connections.itervalues()
+                       if target is not None]
+            if len(targets) > 1:
+                raise ValueError("Component '%s' splits its samples, so it "
+                                 "cannot be run as part of an ensemble" % name)
+            chain.append((name, component))
+            component = targets and targets[0] or None
+        return chain
+    
+    def execute_ensemble(self, cplan, core, aborting, ensemble, 
+                         profile=None, checkpoint=None):
+        """
+        Runs this workflow over core using the computation plan cplan as an
+        ensemble: each component sees all of ensemble's realizations of its 
+        inputs at once, and every output attribute ends up holding the mean 
+        of its realizations, with the median and percentiles stored 
+        alongside (see Ensemble). Returns False if the run was aborted, True
+        otherwise.
+        
+        Samples are processed a chunk at a time where the workflow allows it;
+        profile and checkpoint work as for execute, with progress saved after 
+        each chunk.
+        """
+        components = self.instantiate(cplan)
+        chain = self.ensemble_chain(components)
+        if profile is not None:
+            for name in components:
+                profile.imports[name] = \
+                        cscience.components.library.import_time(name)
+        inputs = self.find_inputs(cplan)
+        self.register_outputs(cplan)
+        outputs = self.find_outputs(cplan)
+        ensemble.register_outputs(outputs)
+        
+        samples = list(core)
+        size = ensemble.chunk_size or len(samples)
+        if self.find_neighborhood(cplan) != 0:
+            #results depend on other samples; they all have to go at once
+            size = len(samples)
+        done = 0
+        if checkpoint is not None:
+            stamp = (self.checkpoint_stamp(cplan, core), 'ensemble', 
+                     ensemble.draws, ensemble.percentiles)
+            state = checkpoint.load(stamp)
+            if state is not None:
+                core.restore_results(state['results'])
+                done = state['done']
+        
+        def invoke(name, component, columns, chunk):
+            results = {}
+            def run(chunk):
+                results.update(component.run_ensemble(columns))
+                return [(component.connections.get('output'), chunk)]
+            run.connections = component.connections
+            if profile is None:
+                run(chunk)
+            else:
+                profile.run(name, run, chunk)
+            return results
+        
+        for start in range(done, len(samples), size or 1):
+            chunk = samples[start:start + size]
+            columns = ensemble.draw(chunk, inputs)
+            for name, component in chain:
+                if aborting():
+                    return False
+                columns.update(invoke(name, component, columns, chunk))
+            if aborting():
+                return False
+            ensemble.summarize(chunk, dict([(att, columns[att]) for att in 
+                                            outputs if att in columns]))
+            if checkpoint is not None:
+                done = start + len(chunk)
+                checkpoint.step(lambda: {'stamp':stamp, 'done':done, 
+                                         'results':core.results()})
+            
+        for sample in core:
+            sample.remove_exp_intermediates()
+        core.record_inputs(inputs, ensemble.mode)
+        if checkpoint is not None:
+            checkpoint.clear()
         return True
 
     def find_first_component(self):
@@ -0,0 +1,109 @@
+"""
+checkpoints.py
+
+* Copyright (c) 2012-2015, University of Colorado.
+* All rights reserved.
+*
+* Redistribution and use in source and binary forms, with or without
+* modification, are permitted provided that the following conditions are met:
+*     * Redistributions of source code must retain the above copyright
+*       notice, this list of conditions and the following disclaimer.
+*     * Redistributions in binary form must reproduce the above copyright
+*       notice, this list of conditions and the following disclaimer in the
+*       documentation and/or other materials provided with the distribution.
+*     * Neither the name of the University of Colorado nor the
+*       names of its contributors may be used to endorse or promote products
+*       derived from this software without specific prior written permission.
+*
+* THIS SOFTWARE IS PROVIDED BY THE UNIVERSITY OF COLORADO ''AS IS'' AND ANY
+* EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+* WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+* DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF COLORADO BE LIABLE FOR ANY
+* DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+* (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+* LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+* ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+* (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+* SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Checkpoints let a long-running workflow pick up where it left off after
+being aborted or crashing, instead of starting over from scratch.
+"""
+
+import cPickle
+import os
+import time
+
+
+class Checkpoint(object):
+    """
+    On-disk record of a workflow run in progress, for a single computation
+    plan applied to a single core.
+    
+    Workflow.execute saves the state of the run (intermediate results and the
+    queue of components still to run) once 'interval' seconds have passed
+    since the last save, or after every 'every' component invocations if that
+    is given, and removes the checkpoint once the run finishes. A 
+    checkpoint is only resumed from if its stamp matches the run being 
+    started, so changed input data or plans start over cleanly.
+    """
+    
+    def __init__(self, directory, plan, core, every=None, interval=30):
+        self.directory = directory
+        self.every = every and max(every, 1)
+        self.interval = interval
+        self.last_saved = time.time()
+        name = '%s - %s.ckpt' % (plan, core)
+        self.path = os.path.join(directory, name.replace(os.sep, '_'))
+        self.unsaved = 0
+        self.resumed = False
+        
+    def load(self, stamp):
+        """
+        Returns the saved state for the run identified by stamp, or None if
+        there isn't a usable one.
+        """
+        try:
+            with open(self.path, 'rb') as ckfile:
+                state = cPickle.load(ckfile)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        if state.get('stamp') != stamp:
+            return None
+        self.resumed = True
+        return state
+    
+    def step(self, get_state):
+        """
+        Called after each component invocation; saves the state returned by 
+        get_state once enough invocations or time have gone by. get_state may
+        return None if the run can't currently be checkpointed.
+        """
+        self.unsaved += 1
+        due = (self.every and self.unsaved >= self.every) or \
+              (self.interval is not None and 
+               time.time() - self.last_saved >= self.interval)
+        if due:
+            state = get_state()
+            if state is not None:
+                self.save(state)
+                self.unsaved = 0
+                self.last_saved = time.time()
+        
+    def save(self, state):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        #write to a scratch file first so a crash mid-save can't leave us
+        #with a corrupt checkpoint
+        scratch = self.path + '.tmp'
+        with open(scratch, 'wb') as ckfile:
+            cPickle.dump(state, ckfile, cPickle.HIGHEST_PROTOCOL)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(scratch, self.path)
+        
+    def clear(self):
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,175 @@
+"""
+ensemble.py
+
+* Copyright (c) 2012-2015, University of Colorado.
+* All rights reserved.
+*
+* Redistribution and use in source and binary forms, with or without
+* modification, are permitted provided that the following conditions are met:
+*     * Redistributions of source code must retain the above copyright
+*       notice, this list of conditions and the following disclaimer.
+*     * Redistributions in binary form must reproduce the above copyright
+*       notice, this list of conditions and the following disclaimer in the
+*       documentation and/or other materials provided with the distribution.
+*     * Neither the name of the University of Colorado nor the
+*       names of its contributors may be used to endorse or promote products
+*       derived from this software without specific prior written permission.
+*
+* THIS SOFTWARE IS PROVIDED BY THE UNIVERSITY OF COLORADO ''AS IS'' AND ANY
+* EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+* WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+* DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF COLORADO BE LIABLE FOR ANY
+* DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+* (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+* LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+* ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+* (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+* SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Support for running a computation plan as an ensemble (Monte Carlo) run. 
+Rather than pushing one value per sample through the workflow, the engine draws
+many perturbed realizations of each input from its error attribute and hands 
+all of them to each component at once as a (samples x draws) array; the 
+results are then reduced back to a mean, median and percentiles per sample.
+"""
+
+import warnings
+
+import numpy as np
+
+import cscience.datastore
+from cscience.framework.samples import Attribute
+
+
+class Ensemble(object):
+    """
+    Settings for an ensemble run of a workflow, along with the helpers that
+    turn samples into input draws and draws back into sample values.
+    
+    draws is the number of realizations; percentiles are the percentiles 
+    (0-100) reported for each output alongside the mean and median. seed, if
+    given, makes the draws repeatable. Samples are pushed through the workflow
+    chunk_size at a time (when the workflow allows it) so that memory use 
+    stays at about chunk_size * draws values per attribute.
+    """
+    
+    numeric_types = ('float', 'integer')
+    
+    def __init__(self, draws=1000, percentiles=(2.5, 16, 84, 97.5), seed=None,
+                 chunk_size=1000):
+        if draws < 1:
+            raise ValueError('An ensemble needs at least one draw')
+        self.draws = draws
+        self.percentiles = tuple(percentiles)
+        self.chunk_size = chunk_size
+        self.random = np.random.RandomState(seed)
+        
+    @property
+    def mode(self):
+        """
+        Identifies runs made with these settings, so results from different
+        settings (or from plain runs) aren't mixed; see Core.changed_depths.
+        """
+        return ('ensemble', self.draws, self.percentiles)
+        
+    def error_attribute(self, att):
+        """
+        Returns the name of the attribute holding the (1 sigma) error for att.
+        """
+        return '%s Error' % att
+    
+    def is_error(self, att):
+        """
+        Tells whether att holds an error (named as by error_attribute, or with
+        a trailing + or - for one side of an asymmetric error) rather than a 
+        drawn quantity.
+        """
+        return att.rstrip('+-').endswith(self.error_attribute(''))
+    
+    def summary_attributes(self, att):
+        """
+        Returns the names of the attributes that hold the median and 
+        percentiles of output att; the mean is stored in att itself. Errors 
+        only get the mean.
+        """
+        if self.is_error(att):
+            return []
+        return ['%s Median' % att] + ['%s (%g%%)' % (att, percentile) for 
+                                      percentile in self.percentiles]
+    
+    def register_outputs(self, outputs):
+        """
+        Makes sure there is an output attribute for every summary value of 
+        each drawn attribute in outputs. Returns the names of any attributes 
+        added.
+        """
+        added = []
+        for att in outputs:
+            for name in self.summary_attributes(att):
+                if name not in cscience.datastore.sample_attributes:
+                    cscience.datastore.sample_attributes.add(
+                                            Attribute(name, 'float', True))
+                    added.append(name)
+        return added
+    
+    def is_numeric(self, att):
+        try:
+            return (cscience.datastore.sample_attributes[att].type_ in 
+                    self.numeric_types)
+        except KeyError:
+            return False
+    
+    def column(self, samples, att):
+        """
+        Returns the values of att for samples as a float array, with missing
+        values as NaN.
+        """
+        return np.array([np.nan if sample[att] is None else sample[att] 
+                         for sample in samples], dtype=float)
+    
+    def draw(self, samples, atts):
+        """
+        Returns a dictionary of attribute name -> array of input values for 
+        each numeric attribute in atts (and their errors). Attributes that 
+        have an error get one normally distributed draw per realization, in
+        an array of shape (samples, draws); all others are shape (samples, 1)
+        and broadcast against the drawn ones.
+        """
+        columns = {}
+        for att in atts:
+            for name in (att, self.error_attribute(att)):
+                if name not in columns and self.is_numeric(name):
+                    columns[name] = self.column(samples, name)[:, np.newaxis]
+        for att in atts:
+            error = self.error_attribute(att)
+            if att in columns and error in columns:
+                #a missing error means no spread, not a missing value
+                spread = np.nan_to_num(columns[error])
+                noise = self.random.standard_normal((len(samples), self.draws))
+                columns[att] = columns[att] + spread * noise
+        return columns
+    
+    def summarize(self, samples, outputs):
+        """
+        Reduces each output array (samples x draws) to its mean, median and
+        percentiles and stores those in samples (just the mean, for errors). 
+        Draws that came out as NaN are ignored; a sample with no valid draws 
+        gets None.
+        """
+        for att, values in outputs.iteritems():
+            values = np.asarray(values, dtype=float)
+            if values.ndim == 1:
+                values = values[:, np.newaxis]
+            with warnings.catch_warnings():
+                #all-NaN rows are expected for samples missing their inputs
+                warnings.simplefilter('ignore', RuntimeWarning)
+                stats = [np.nanmean(values, axis=1)]
+                names = [att] + self.summary_attributes(att)
+                if len(names) > 1:
+                    stats.extend(np.nanpercentile(values, (50,) + 
+                                                  self.percentiles, axis=1))
+            for index, sample in enumerate(samples):
+                for name, stat in zip(names, stats):
+                    value = stat[index]
+                    sample[name] = None if np.isnan(value) else float(value)
@@ -28,9 +28,11 @@ collections.py
 """
 
 import collections
+import functools
+import itertools
 
 import cscience.datastore
-from cscience.framework.samples import _types
+from cscience.framework.samples import _types, convert_column, read_columns
 from cscience.framework import Collection
 
 class TemplateField(object):
@@ -121,12 +123,61 @@ class Template(collections.OrderedDict):
                                     for att in self.iter_nonkeys()])   
             
         return milieu
+    
+    def load_milieu(self, reader, fieldnames, chunk_size=10000):
+        """
+        Builds a Milieu from reader, an iterator of rows as lists of strings 
+        (such as a csv.reader) whose columns are named by fieldnames. Rows 
+        are read chunk_size at a time, and each template field is converted a
+        whole column at once.
+        
+        Returns the Milieu along with a list of problems, as (row number, 
+        field name, value) tuples; rows with any problem are left out of the 
+        Milieu. A field name of None means the row had too few columns.
+        Raises a ValueError if fieldnames doesn't cover the template.
+        """
+        if not self or len(self) < 2:
+            #can't have a milieu with only one column (or no columns)
+            raise ValueError()
+        missing = [name for name in self if name not in fieldnames]
+        if missing:
+            raise ValueError('Missing columns for template fields: %s' % 
+                             ', '.join(missing))
+        columns = [(fieldnames.index(name), name, 
+                    functools.partial(convert_column, self[name].field_type))
+                   for name in self]
+        nonkeys = list(self.iter_nonkeys())
+        
+        milieu = Milieu(self)
+        errors = []
+        for rows, problems in read_columns(reader, columns, chunk_size):
+            errors.extend(problems)
+            if self.key_fields:
+                keys = [tuple([values[name] for name in self.key_fields]) 
+                        for number, values in rows]
+            else:
+                keys = [(number,) for number, values in rows]
+            #a brand new milieu, so there's no version to bump per row
+            dict.update(milieu, [(key, dict([(name, values[name]) for 
+                                             name in nonkeys])) 
+                                 for key, (number, values) in zip(keys, rows)])
+        errors.sort(key=lambda error: error[0])
+        return milieu, errors
         
 class Templates(Collection):
     _filename = 'templates'
 
+#every Milieu content change gets a new number, so cached lookup structures
+#(see components.datastructures.IndexCache) can tell they're out of date
+_versions = itertools.count(1)
+
 class Milieu(dict):
     
+    def __new__(cls, *args, **kwargs):
+        self = super(Milieu, cls).__new__(cls, *args, **kwargs)
+        self.version = next(_versions)
+        return self
+    
     def __init__(self, template, name='[NONE]'):
         self.name = name
         self._template = template.name
@@ -146,6 +197,19 @@ class Milieu(dict):
             return super(Milieu, self).__getitem__(key)
         except KeyError:
             return super(Milieu, self).__getitem__((key,))
+        
+    def __setitem__(self, key, value):
+        self.version = next(_versions)
+        super(Milieu, self).__setitem__(key, value)
+    def __delitem__(self, key):
+        self.version = next(_versions)
+        super(Milieu, self).__delitem__(key)
+        
+    def __getstate__(self):
+        #versions only mean anything within one run of the program
+        state = self.__dict__.copy()
+        state.pop('version', None)
+        return state
 
 
 class Milieus(Collection):
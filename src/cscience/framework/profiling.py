@@ -0,0 +1,201 @@
+"""
+profiling.py
+
+* Copyright (c) 2012-2015, University of Colorado.
+* All rights reserved.
+*
+* Redistribution and use in source and binary forms, with or without
+* modification, are permitted provided that the following conditions are met:
+*     * Redistributions of source code must retain the above copyright
+*       notice, this list of conditions and the following disclaimer.
+*     * Redistributions in binary form must reproduce the above copyright
+*       notice, this list of conditions and the following disclaimer in the
+*       documentation and/or other materials provided with the distribution.
+*     * Neither the name of the University of Colorado nor the
+*       names of its contributors may be used to endorse or promote products
+*       derived from this software without specific prior written permission.
+*
+* THIS SOFTWARE IS PROVIDED BY THE UNIVERSITY OF COLORADO ''AS IS'' AND ANY
+* EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+* WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+* DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF COLORADO BE LIABLE FOR ANY
+* DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+* (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+* LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+* ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+* (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+* SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Instrumentation for workflow execution. An ExecutionProfile is handed to
+Workflow.execute and records timing, sample counts and memory use for every
+component invocation, so slow computation plans can be traced back to the
+component responsible.
+"""
+
+import cProfile
+import csv
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    #not available on windows; memory use simply won't be reported there.
+    resource = None
+
+
+def peak_memory():
+    """
+    Returns the peak resident memory of this process (in kilobytes on linux,
+    bytes on OS X), or None if that can't be determined on this platform.
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+def count_samples(samples):
+    try:
+        return len(samples)
+    except TypeError:
+        return None
+
+
+class ComponentRun(object):
+    """
+    The measurements taken for a single invocation of a single component.
+    """
+    
+    fields = ('index', 'component', 'wall_time', 'cpu_time', 'samples_in', 
+              'samples_out', 'ports', 'memory_delta')
+
+    def __init__(self, index, component):
+        self.index = index
+        self.component = component
+        self.wall_time = 0
+        self.cpu_time = 0
+        self.samples_in = None
+        self.samples_out = None
+        self.ports = []
+        self.memory_delta = None
+        
+    def as_dict(self):
+        return dict([(field, getattr(self, field)) for field in self.fields])
+        
+
+class ExecutionProfile(object):
+    """
+    Collects a ComponentRun for each component invocation made while a
+    workflow executes.
+    
+    listener, if given, is called with each ComponentRun as soon as it is 
+    recorded; note that this happens on whatever thread the workflow is
+    running on.
+    If use_cprofile is set, a cProfile profile is also kept for each
+    component (accumulated over all of that component's invocations).
+    """
+
+    def __init__(self, plan, core, use_cprofile=False, listener=None):
+        self.plan = plan
+        self.core = core
+        self.use_cprofile = use_cprofile
+        self.listener = listener
+        self.runs = []
+        self.profiles = {}
+        #component name -> seconds spent importing its module
+        self.imports = {}
+        
+    def run(self, name, component, samples):
+        """
+        Invokes component on samples, recording the invocation as name.
+        Returns whatever the component returns.
+        """
+        record = ComponentRun(len(self.runs), name)
+        record.samples_in = count_samples(samples)
+        
+        if self.use_cprofile:
+            profiler = self.profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        mem = peak_memory()
+        cpu = cpu_time()
+        wall = time.time()
+        try:
+            pending = component(samples)
+        finally:
+            record.wall_time = time.time() - wall
+            record.cpu_time = cpu_time() - cpu
+            if mem is not None:
+                record.memory_delta = peak_memory() - mem
+            if self.use_cprofile:
+                profiler.disable()
+            
+        record.samples_out = 0
+        for target, out in pending:
+            if out:
+                record.ports.append(self.port_name(component, target))
+                record.samples_out += count_samples(out) or 0
+        self.runs.append(record)
+        if self.listener:
+            self.listener(record)
+        return pending
+    
+    def port_name(self, component, target):
+        for port, connection in getattr(component, 'connections', {}).iteritems():
+            if connection is target:
+                return port
+        return '?'
+    
+    def totals(self):
+        """
+        Returns a dictionary of component name -> (invocations, wall time, 
+        cpu time), summed over all recorded invocations.
+        """
+        totals = {}
+        for record in self.runs:
+            count, wall, cpu = totals.get(record.component, (0, 0, 0))
+            totals[record.component] = (count + 1, wall + record.wall_time, 
+                                        cpu + record.cpu_time)
+        return totals
+            
+    def report_name(self):
+        name = '%s - %s' % (self.plan, self.core)
+        return name.replace(os.sep, '_')
+    
+    def write_report(self, directory):
+        """
+        Writes this profile to directory as both JSON and CSV, plus one .prof
+        file (readable with pstats) per component if cProfile capture was
+        requested. Returns the list of files written.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        base = os.path.join(directory, self.report_name())
+        written = []
+        
+        with open(base + '.json', 'wb') as report:
+            json.dump({'computation plan':self.plan, 'core':self.core,
+                       'component imports':self.imports,
+                       'runs':[record.as_dict() for record in self.runs]}, 
+                      report, indent=2, separators=(',', ': '))
+        written.append(base + '.json')
+        
+        with open(base + '.csv', 'wb') as report:
+            writer = csv.writer(report)
+            writer.writerow(ComponentRun.fields)
+            for record in self.runs:
+                row = record.as_dict()
+                row['ports'] = ' '.join(record.ports)
+                writer.writerow([unicode(row[field]).encode('utf-8') 
+                                 for field in ComponentRun.fields])
+        written.append(base + '.csv')
+        
+        for name, profiler in self.profiles.iteritems():
+            filename = '%s - %s.prof' % (base, name.replace(os.sep, '_'))
+            profiler.dump_stats(filename)
+            written.append(filename)
+        return written
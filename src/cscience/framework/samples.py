@@ -28,6 +28,9 @@ samples.py
 """
 
 import bisect
+import functools
+import itertools
+import numpy as np
 import cscience.datastore
 from cscience.framework import Collection
 
@@ -47,6 +50,80 @@ def show_str(x):
     return unicode(x)
 
 _types = {'string':unicode, 'boolean':conv_bool, 'float':float, 'integer':int}
+
+def convert_column(type_, values):
+    """
+    Converts a whole column of strings to the named type in one go. Returns
+    the list of converted values and a list of (index, value) pairs for the 
+    cells that could not be converted (which are None in the converted list).
+    """
+    converter = _types[type_]
+    try:
+        if type_ == 'float':
+            return np.array(values, dtype=float).tolist(), []
+        return [converter(value) for value in values], []
+    except (ValueError, TypeError):
+        pass
+    #some cells are bad (or ints written as floats); go one at a time
+    converted = []
+    bad = []
+    for index, value in enumerate(values):
+        try:
+            converted.append(converter(value))
+        except (ValueError, TypeError):
+            try:
+                converted.append(converter(float(value)))
+            except (ValueError, TypeError):
+                converted.append(None)
+                bad.append((index, value))
+    return converted, bad
+
+def read_columns(reader, columns, chunk_size=10000):
+    """
+    Reads rows of strings from reader (such as a csv.reader) chunk_size at a 
+    time, converting each wanted column of a chunk in one go. columns is a 
+    list of (position, name, convert) for the wanted columns, where convert 
+    takes a list of strings and works like convert_column. Blank rows are 
+    skipped.
+    
+    Yields (rows, errors) for each chunk: rows is a list of (row number, 
+    {name: value}) for the rows read cleanly, and errors a list of (row 
+    number, name, value) for the problems found; rows with any problem are
+    left out of rows. A name of None means the row had too few columns.
+    """
+    width = max([position for position, name, convert in columns] or [-1]) + 1
+    names = [name for position, name, convert in columns]
+    first = 0
+    while True:
+        chunk = list(itertools.islice(reader, chunk_size))
+        if not chunk:
+            break
+        errors = []
+        numbers = []
+        rows = []
+        for number, row in enumerate(chunk, first):
+            if not row:
+                #blank line
+                continue
+            elif len(row) < width:
+                errors.append((number, None, row))
+            else:
+                numbers.append(number)
+                rows.append(row)
+        first += len(chunk)
+        
+        converted = []
+        bad = set()
+        for position, name, convert in columns:
+            values, problems = convert([row[position] for row in rows])
+            converted.append(values)
+            for index, value in problems:
+                errors.append((numbers[index], name, value))
+                bad.add(index)
+        
+        yield ([(numbers[index], dict(zip(names, values))) for index, values in
+                enumerate(zip(*converted)) if index not in bad], errors)
+
 _comps = {'string':unicode}
 _formats = {'string':show_str, 'boolean':str,
             'float':lambda x: '%.2f' % x, 'integer':lambda x: '%d' % x}
@@ -159,6 +236,41 @@ class Attributes(Collection):
         type appropriate to the attribute (if known) or a string otherwise
         """
         return self[att].convert_value(value)
+    
+    def convert_column(self, att, values):
+        """
+        Converts a whole column of strings for att at once (see the module
+        function convert_column); unknown attributes are treated as strings.
+        """
+        try:
+            type_ = self[att].type_
+        except KeyError:
+            type_ = 'string'
+        if type_ not in _types:
+            type_ = 'string'
+        return convert_column(type_, values)
+    
+    def load_samples(self, reader, fieldnames, chunk_size=10000):
+        """
+        Reads sample data from reader, an iterator of rows as lists of strings
+        (such as a csv.reader) whose columns are named by fieldnames. Rows are
+        read chunk_size at a time, and each attribute is converted a whole
+        column at once.
+        
+        Returns a list of {attribute: value} dictionaries along with a list of
+        problems, as (row number, attribute, value) tuples; rows with any 
+        problem are left out. An attribute of None means the row had too few
+        columns.
+        """
+        columns = [(index, name, functools.partial(self.convert_column, name))
+                   for index, name in enumerate(fieldnames) if name]
+        samples = []
+        errors = []
+        for rows, problems in read_columns(reader, columns, chunk_size):
+            samples.extend([values for number, values in rows])
+            errors.extend(problems)
+        errors.sort(key=lambda error: error[0])
+        return samples, errors
         
     def format_value(self, att, value):
         """
@@ -223,8 +335,13 @@ class VirtualSample(object):
         self.sample.setdefault(self.computation_plan, {})
         
     def remove_exp_intermediates(self):
+        """
+        Drops everything but output attributes from this sample's computed 
+        data; values for attributes that don't exist count as intermediates.
+        """
+        attributes = cscience.datastore.sample_attributes
         for key in self.sample[self.computation_plan].keys():
-            if not cscience.datastore.sample_attributes[key].output:
+            if key not in attributes or not attributes[key].output:
                 del self[key]
         
     def __getitem__(self, key):
@@ -275,11 +392,16 @@ class Core(dict):
     def __new__(cls, *args, **kwargs):
         self = super(Core, cls).__new__(cls, *args, **kwargs)
         self.cplans = set(['input'])
+        self.input_stamps = {}
         return self
     
     def __init__(self, name='New Core'):
         self.name = name
         self.cplans = set(['input'])
+        #computation plan -> ((attributes used, run mode), {depth: input 
+        #values}) as of the last successful run of that plan; see 
+        #changed_depths
+        self.input_stamps = {}
         
     def new_computation(self, cplan):
         """
@@ -292,7 +414,72 @@ class Core(dict):
             raise ValueError('Cannot overwrite existing computations')
         self.cplans.add(cplan)
         return VirtualCore(self, cplan)
+    
+    def recompute(self, cplan, depths):
+        """
+        Returns a VirtualCore for an existing computation plan on this Core 
+        that covers only the given depths, for re-running the plan on just
+        those samples. The plan's old results for those samples are cleared,
+        so nothing the new run doesn't produce is left behind.
+        """
+        if cplan not in self.cplans or cplan == 'input':
+            raise KeyError(cplan)
+        for depth in depths:
+            self[depth][cplan] = {}
+        return VirtualCore(self, cplan, depths)
+    
+    def input_stamp(self, depth, atts):
+        inputs = self[depth]['input']
+        return tuple([inputs.get(att) for att in atts])
+    
+    def record_inputs(self, cplan, atts, depths, mode=None):
+        """
+        Remember the current values of the input attributes atts for the
+        samples at depths, as having been used to compute cplan. mode 
+        identifies how the plan was run (None for a plain run; see 
+        Ensemble.mode).
+        """
+        atts = tuple(sorted(atts))
+        used, stamps = self.input_stamps.get(cplan, ((atts, mode), {}))
+        if used != (atts, mode):
+            stamps = {}
+        for depth in depths:
+            stamps[depth] = self.input_stamp(depth, atts)
+        self.input_stamps[cplan] = ((atts, mode), stamps)
         
+    def changed_depths(self, cplan, atts, neighborhood=0, mode=None):
+        """
+        Returns a sorted list of the depths whose results for cplan are out of
+        date: samples added or with any of the input attributes atts changed
+        since cplan was last run, plus up to neighborhood samples either side
+        of each of those (and of any samples deleted since). A negative 
+        neighborhood means that any change affects the whole core. If the 
+        plan was last run in a different mode, every depth is out of date.
+        """
+        depths = sorted(self.keys())
+        atts = tuple(sorted(atts))
+        used, stamps = self.input_stamps.get(cplan, (None, {}))
+        if used != (atts, mode):
+            return depths
+        
+        changed = set([index for index, depth in enumerate(depths) if 
+                       stamps.get(depth) != self.input_stamp(depth, atts)])
+        if not neighborhood:
+            return [depths[index] for index in sorted(changed)]
+        
+        #a deleted sample changes the neighborhood of the ones around it
+        deleted = [bisect.bisect_left(depths, depth) for depth in stamps 
+                   if depth not in self]
+        if neighborhood < 0:
+            return depths if (changed or deleted) else []
+        affected = set()
+        for index in changed:
+            affected.update(range(index - neighborhood, index + neighborhood + 1))
+        for index in deleted:
+            affected.update(range(index - neighborhood, index + neighborhood))
+        return [depths[index] for index in sorted(affected) 
+                if 0 <= index < len(depths)]
+
     def virtualize(self):
         """
         Returns a full set of virtual cores applicable to this Core
@@ -321,6 +508,18 @@ class Core(dict):
             except KeyError:
                 pass
         self.cplans.remove(exp)
+        self.input_stamps.pop(exp, None)
+        
+    def strip_samples(self, exp, depths):
+        """
+        Removes the results of exp from only the samples at the given depths.
+        """
+        if exp == 'input':
+            raise KeyError()
+        used, stamps = self.input_stamps.get(exp, (None, {}))
+        for depth in depths:
+            self[depth].pop(exp, None)
+            stamps.pop(depth, None)
         
     def __setitem__(self, depth, sample):
         super(Core, self).__setitem__(depth, sample)
@@ -330,6 +529,16 @@ class Core(dict):
         sample['input']['core'] = self.name
         self[sample['input']['depth']] = sample
         
+    def add_all(self, samples):
+        """
+        Adds many samples at once; equivalent to calling add on each of them.
+        """
+        for sample in samples:
+            sample['input']['core'] = self.name
+            self.cplans.update(sample.keys())
+        super(Core, self).update([(sample['input']['depth'], sample) 
+                                  for sample in samples])
+        
     def __iter__(self):
         for key in sorted(self.keys()):
             yield self[key]
@@ -337,12 +546,18 @@ class Core(dict):
 class VirtualCore(object):
     #has a Core and an experiment, returns VirtualSamples for items instead
     #of Samples. Hurrah!
-    def __init__(self, core, cplan):
+    #If depths is given, only the samples at those depths are included.
+    def __init__(self, core, cplan, depths=None):
         self.core = core
         self.computation_plan = cplan
+        self.depths = depths
         
     def keys(self):
+        if self.depths is not None:
+            return list(self.depths)
         return self.core.keys()
+    def __len__(self):
+        return len(self.keys())
     def __iter__(self):
         for key in sorted(self.keys()):
             yield self[key]
@@ -352,6 +567,33 @@ class VirtualCore(object):
         return VirtualSample(self.core[key], self.computation_plan)
     def strip_experiment(self, exp):
         return self.core.strip_experiment(exp)
+    def discard(self):
+        """
+        Throw away this computation plan's results for the samples covered by
+        this VirtualCore (removing the plan from the core entirely if that's
+        all of them)
+        """
+        if self.depths is None:
+            self.core.strip_experiment(self.computation_plan)
+        else:
+            self.core.strip_samples(self.computation_plan, self.depths)
+    def record_inputs(self, atts, mode=None):
+        self.core.record_inputs(self.computation_plan, atts, self.keys(), mode)
+    def input_stamp(self, depth, atts):
+        return self.core.input_stamp(depth, atts)
+    def subset(self, depths):
+        return VirtualCore(self.core, self.computation_plan, depths)
+    
+    def results(self):
+        """
+        Returns a copy of this computation plan's data for each sample 
+        covered, keyed by depth.
+        """
+        return dict([(depth, dict(self.core[depth].get(self.computation_plan, {})))
+                     for depth in self.keys()])
+    def restore_results(self, results):
+        for depth, data in results.iteritems():
+            self.core[depth][self.computation_plan] = dict(data)
         
 
 class Cores(Collection):
@@ -0,0 +1,47 @@
+"""
+test_interpolations.py
+
+Tests for fitting age-depth models to dated samples.
+"""
+
+import unittest
+
+import numpy as np
+
+import cscience.datastore
+from cscience.components import interpolations
+
+
+class MergeDepthsTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.depths = np.array([1.0, 2.0, 2.0, 3.0, 4.0])
+        self.ages = np.array([100.0, 200.0, 220.0, 300.0, 400.0])
+        
+    def test_weighted_by_error(self):
+        errors = np.array([10.0, 10.0, 20.0, 10.0, 10.0])
+        depths, ages, errors = interpolations.merge_depths(self.depths, 
+                                                    self.ages, errors)
+        self.assertEqual(list(depths), [1.0, 2.0, 3.0, 4.0])
+        self.assertAlmostEqual(ages[1], 204.0)
+        self.assertAlmostEqual(errors[1], 1 / np.sqrt(0.0125))
+        self.assertEqual(list(ages[[0, 2, 3]]), [100.0, 300.0, 400.0])
+        
+    def test_unknown_error(self):
+        errors = np.array([10.0, 0.0, 20.0, 10.0, 10.0])
+        depths, ages, errors = interpolations.merge_depths(self.depths, 
+                                                    self.ages, errors)
+        self.assertAlmostEqual(ages[1], 210.0)
+        self.assertEqual(errors[1], 0)
+        
+    def test_models_fit(self):
+        errors = np.array([10.0, 10.0, 20.0, 10.0, 10.0])
+        merged = interpolations.merge_depths(self.depths, self.ages, errors)
+        for cls in (interpolations.LinearInterpolation, 
+                    interpolations.MonotoneCubicInterpolation):
+            ages = cls().fit(*merged)(np.array([1.0, 2.0, 3.0]))
+            self.assertTrue(np.allclose(ages, [100.0, 204.0, 300.0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
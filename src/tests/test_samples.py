@@ -0,0 +1,59 @@
+"""
+test_samples.py
+
+Tests for re-running a computation plan on part of a Core.
+"""
+
+import unittest
+
+import cscience.datastore
+from cscience.framework.samples import Core, Sample
+
+
+class RecomputeTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.core = Core('test')
+        for depth in (1.0, 2.0, 3.0):
+            self.core.add(Sample('input', {'depth':depth, '14C Age':1000}))
+        vcore = self.core.new_computation('plan')
+        for sample in vcore:
+            sample['Calibrated 14C Age'] = 900
+            sample['Calibrated 14C Age Median'] = 905
+        vcore.record_inputs(['14C Age'])
+        
+    def test_clears_old_results(self):
+        vcore = self.core.recompute('plan', [2.0])
+        self.assertEqual(vcore.keys(), [2.0])
+        #the new run only produces some of what the old one did
+        vcore[2.0]['Calibrated 14C Age'] = 950
+        
+        self.assertEqual(self.core[2.0]['plan'], {'Calibrated 14C Age':950})
+        self.assertEqual(vcore[2.0]['Calibrated 14C Age Median'], None)
+        
+    def test_keeps_other_depths(self):
+        self.core.recompute('plan', [2.0])
+        for depth in (1.0, 3.0):
+            self.assertEqual(self.core[depth]['plan'], 
+                             {'Calibrated 14C Age':900, 
+                              'Calibrated 14C Age Median':905})
+            
+    def test_changed_depths(self):
+        self.assertEqual(self.core.changed_depths('plan', ['14C Age']), [])
+        self.core[2.0]['input']['14C Age'] = 1100
+        depths = self.core.changed_depths('plan', ['14C Age'])
+        self.assertEqual(depths, [2.0])
+        self.core.recompute('plan', depths)
+        self.assertEqual(self.core[2.0]['plan'], {})
+        #a different run mode means everything is out of date
+        self.assertEqual(self.core.changed_depths('plan', ['14C Age'], 
+                                                  mode=('ensemble', 10, ())),
+                         [1.0, 2.0, 3.0])
+        
+    def test_unknown_plan(self):
+        self.assertRaises(KeyError, self.core.recompute, 'other', [1.0])
+        self.assertRaises(KeyError, self.core.recompute, 'input', [1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
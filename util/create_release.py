@@ -17,6 +17,7 @@ that might otherwise accumluate in a directory used for development, such as
 
 import os
 import os.path
+import subprocess
 import sys
 import time
 
@@ -84,3 +85,8 @@ for root, dirs, files in os.walk(dest_dir, topdown=False):
         data_dir = os.path.join(root, name)
         if ".svn" in data_dir:
             os.rmdir(data_dir)
+
+# rebuild the component manifest so it matches the released components
+# (-B keeps the build from leaving .pyc files behind)
+subprocess.check_call([sys.executable, "-B", "-m", "cscience.components"],
+                      cwd=dest_src_path)